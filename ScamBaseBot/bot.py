@@ -3,30 +3,61 @@ nest_asyncio.apply()
 
 import logging
 import json
+import csv
+import copy
+import gzip
 import os
 import re
 import random
+import bisect
+import heapq
 import traceback
 import asyncio
 import sys
+import time
+import atexit
+import contextlib
+import contextvars
+import itertools
+import mmap
+import sqlite3
+import secrets
+from collections import OrderedDict, Counter
+from collections.abc import MutableMapping
+from types import MappingProxyType
 from typing import Dict, Optional, List, Tuple
 from datetime import datetime
 from enum import Enum
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, PhotoSize
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    PhotoSize
+)
+from telegram.error import RetryAfter, BadRequest
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
+    BaseRateLimiter,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
+    InlineQueryHandler,
     ContextTypes,
     filters
 )
 
 # Telethon для User API
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
 from telethon.tl.functions.users import GetUsersRequest
-from telethon.tl.types import User
+from telethon.tl.types import User, InputUser
+from telethon.errors import UsernameNotOccupiedError, UsernameInvalidError
 
 # Настройка логирования
 logging.basicConfig(
@@ -40,6 +71,7 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Конфигурация - пути относительно папки скрипта
 DB_FILE = os.path.join(SCRIPT_DIR, 'data', 'scammers_db.json')
+SQLITE_DB_FILE = os.path.join(SCRIPT_DIR, 'data', 'scammers.sqlite3')
 CONFIG_FILE = os.path.join(SCRIPT_DIR, 'config.json')
 IMAGES_FOLDER = os.path.join(SCRIPT_DIR, 'bot_images')
 ADMIN_CHAT_ID = -1003660247060  # ID админ-чата
@@ -52,10 +84,125 @@ TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_API_ID = os.getenv('TELEGRAM_API_ID')
 TELEGRAM_API_HASH = os.getenv('TELEGRAM_API_HASH')
 
+# Импорт базы (/import): размер пачки, частота сообщений о прогрессе и
+# максимальный размер файла, который бот может скачать через Bot API
+IMPORT_BATCH_SIZE = 1000
+IMPORT_PROGRESS_INTERVAL = 5  # секунд
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+IMPORT_READ_CHUNK = 64 * 1024
+
+# Выгрузка базы (/export): форматы, колонки CSV и предел Bot API для отправки файла
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_CSV_FIELDS = ('user_id', 'username', 'status', 'country', 'reports', 'added_date', 'reasons', 'proofs')
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024
+
+# Сколько обновлений обрабатывать одновременно и сколько держать в очереди
+CONCURRENT_UPDATES = 64
+UPDATE_BACKLOG_LIMIT = 1024
+
+# Ограничение частоты запросов от одного пользователя (админы не ограничиваются)
+THROTTLE_RATE = 1.0  # запросов в секунду в среднем
+THROTTLE_BURST = 5  # запросов подряд без ожидания
+# Inline-запросы Telegram шлет на каждое нажатие клавиши: у них своя, более емкая корзина
+THROTTLE_INLINE_RATE = 3.0
+THROTTLE_INLINE_BURST = 20
+THROTTLE_NOTICE_INTERVAL = 10  # секунд между предупреждениями одному пользователю
+
+# Приоритеты обновлений: меньше - раньше
+PRIORITY_ADMIN = 0  # владелец, админы и админ-чат
+PRIORITY_INTERACTIVE = 1  # команды, сообщения, inline-запросы
+PRIORITY_BUTTONS = 2  # нажатия кнопок меню
+
+# Исходящие сообщения: лимиты Telegram (запас, размер пачки и скорость)
+OUTBOUND_GLOBAL_BURST = 30
+OUTBOUND_GLOBAL_RATE = 30.0  # сообщений в секунду на бота
+OUTBOUND_GROUP_BURST = 20
+OUTBOUND_GROUP_RATE = 20 / 60  # сообщений в секунду в одну группу
+OUTBOUND_PRIVATE_BURST = 5
+OUTBOUND_PRIVATE_RATE = 1.0  # сообщений в секунду в личный чат
+# Повторы после RetryAfter: ответы в обработчике ждут недолго,
+# фоновые уведомления повторяются, пока не уйдут
+OUTBOUND_INTERACTIVE_RETRIES = 1
+OUTBOUND_INTERACTIVE_MAX_WAIT = 5  # секунд
+OUTBOUND_BACKGROUND_RETRIES = 5
+
+# Журнал изменений базы: сжатие в снапшот по расписанию
+JOURNAL_COMPACT_INTERVAL = 300  # секунд между проверками
+JOURNAL_COMPACT_THRESHOLD = 500  # записей в журнале, после которых делаем снапшот
+
+# Горячая перезагрузка: как часто проверять, не изменили ли config.json и базу извне
+RELOAD_CHECK_INTERVAL = 5  # секунд
+
+# Общий режим (shared_state): несколько процессов-воркеров на одной базе SQLite
+SHARED_POLL_INTERVAL = 0.5  # секунд - наибольшая задержка, с которой видны изменения других воркеров
+SHARED_CACHE_SIZE = 10000  # записей в кэше чтения каждого воркера
+SHARED_CACHE_TTL = 300  # секунд (страховка на случай пропущенного уведомления)
+SHARED_CHANGES_KEEP = 10000  # сколько последних изменений хранить в таблице changes
+
+# Кэш ответов Telegram User API
+USER_CACHE_SIZE = 10000  # максимум записей
+USER_CACHE_TTL = 600  # секунд для найденных пользователей
+USER_CACHE_NEGATIVE_TTL = 60  # секунд для "не найден"
+USER_BATCH_WINDOW = 0.02  # секунд ожидания перед отправкой пачки GetUsersRequest
+USER_BATCH_SIZE = 100  # максимум ID в одном GetUsersRequest
+
+# Кэш проверки подписки на канал
+SUBSCRIPTION_CACHE_SIZE = 50000
+SUBSCRIPTION_CACHE_TTL = 600  # секунд для подписанных
+SUBSCRIPTION_CACHE_NEGATIVE_TTL = 60  # секунд для неподписанных
+# Команды, для которых требуется подписка на канал
+SUBSCRIPTION_COMMANDS = {'start', 'help', 'check', 'checkmany', 'checkme', 'stats'}
+SUBSCRIBED_STATUSES = ('member', 'administrator', 'creator', 'owner')
+
 # Канал для обязательной подписки
 REQUIRED_CHANNEL_ID = -1002129588192  # ID канала для подписки
 REQUIRED_CHANNEL_USERNAME = "@wzkbnews"  # Username канала
 
+# Сколько записей показывать на одной странице /recent
+RECENT_PAGE_SIZE = 10
+# Курсоры /recent длиннее лимита callback_data (64 байта) бот хранит сам под коротким токеном
+RECENT_CURSOR_CACHE_SIZE = 1000
+RECENT_CURSOR_TTL = 24 * 3600  # секунд
+CALLBACK_DATA_LIMIT = 64
+# Сколько найденных записей выводить в ответе /search
+SEARCH_RESULT_LIMIT = 20
+# Массовая проверка /checkmany: максимум идентификаторов и параллельных запросов
+CHECKMANY_LIMIT = 50
+CHECKMANY_CONCURRENCY = 8
+# Inline-режим: число подсказок и время кэширования ответа в Telegram.
+# Telegram шлет запрос на каждую букву, поэтому @username ищется через User API,
+# только если пользователь перестал печатать на INLINE_RESOLVE_DELAY секунд
+INLINE_RESULT_LIMIT = 20
+INLINE_CACHE_TIME = 30
+INLINE_RESOLVE_DELAY = 0.8
+INLINE_TRACK_SIZE = 10000  # пользователей, чей последний inline-запрос помним
+
+# Поиск похожих username: минимальная длина имени, сколько кандидатов
+# проверять расстоянием Левенштейна и сколько показывать
+FUZZY_MIN_LENGTH = 4
+FUZZY_MAX_CANDIDATES = 100
+FUZZY_MAX_POSTINGS = 5000  # триграммы, встречающиеся чаще, не участвуют в отборе кандидатов
+FUZZY_SUGGESTIONS = 3
+# Похожие по начертанию символы (латиница/кириллица/цифры) приводятся к одному
+HOMOGLYPHS = str.maketrans({
+    '0': 'o', '1': 'l', 'i': 'l', '|': 'l',
+    'а': 'a', 'в': 'b', 'е': 'e', 'ё': 'e', 'к': 'k', 'м': 'm', 'н': 'h',
+    'о': 'o', 'р': 'p', 'с': 'c', 'т': 't', 'у': 'y', 'х': 'x',
+    '_': None, '.': None, '-': None,
+})
+
+# Страны: в базе хранится код, пользователю показывается название
+COUNTRY_NAMES = {
+    'RU': '🇷🇺 Россия',
+    'UA': '🇺🇦 Украина',
+    'BY': '🇧🇾 Беларусь',
+    'KZ': '🇰🇿 Казахстан',
+    'US': '🇺🇸 США',
+    'EU': '🇪🇺 Европа',
+    'TR': '🇹🇷 Турция',
+    'AZ': '🇦🇿 Азербайджан'
+}
+
 # Права доступа
 class UserRole(Enum):
     USER = "user"        # Обычный пользователь
@@ -63,6 +210,14 @@ class UserRole(Enum):
     SPECIAL_ADMIN = "special_admin"  # Спец-админ (может удалять)
     OWNER = "owner"      # Владелец (все права)
 
+# Уровни ролей для сравнения прав
+ROLE_LEVELS = MappingProxyType({
+    UserRole.USER: 0,
+    UserRole.ADMIN: 1,
+    UserRole.SPECIAL_ADMIN: 2,
+    UserRole.OWNER: 3
+})
+
 # Конфигурация по умолчанию
 DEFAULT_CONFIG = {
     "owner_id": 1307172745,  # Ваш ID
@@ -78,14 +233,132 @@ DEFAULT_CONFIG = {
         "warning": None,
         "admin": None
     },
+    "image_file_ids": {},  # file_id загруженных картинок: {тип: {"path": ..., "file_id": ...}}
     "restrict_add_to_admin_chat": True,
-    "check_subscription": True  # Включить проверку подписки
+    "check_subscription": True,  # Включить проверку подписки
+    "storage_backend": "json",  # Хранилище базы: "json" или "sqlite"
+    "write_behind": {  # Отложенная запись базы и конфига
+        "enabled": True,
+        "delay_ms": 500,
+        "max_pending": 50
+    },
+    "shared_state": {  # Несколько процессов-воркеров на одной базе SQLite (только с webhook)
+        "enabled": False,
+        "workers": 1  # сколько процессов делят общий лимит отправки сообщений
+    },
+    "webhook": {  # Прием обновлений через webhook вместо polling (за reverse proxy)
+        "enabled": False,
+        "url": "",  # Внешний адрес, например https://bot.example.com
+        "url_path": "telegram",
+        "listen": "127.0.0.1",
+        "port": 8443,
+        "secret_token": "",  # Обязателен при shared_state.workers > 1
+        "max_connections": 40
+    }
 }
 
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """Сигнатура файла (inode, размер, mtime в нс) или None, если файла нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+class WriteBehind:
+    """Отложенная запись: копит изменения и сбрасывает их одним вызовом.
+
+    Сброс происходит через delay секунд после первого изменения или сразу,
+    когда накопилось max_pending изменений. Без запущенного event loop
+    (и при delay = 0) запись выполняется немедленно.
+    """
+    def __init__(self, flush_callback, delay: float = 0.0, max_pending: int = 50):
+        self.flush_callback = flush_callback
+        self.delay = delay
+        self.max_pending = max_pending
+        self.pending = 0
+        self._timer = None
+    
+    @classmethod
+    def from_settings(cls, flush_callback, settings: Optional[Dict]) -> 'WriteBehind':
+        """Создать по секции write_behind из конфига"""
+        settings = settings or {}
+        delay = settings.get('delay_ms', 500) / 1000 if settings.get('enabled', True) else 0.0
+        return cls(flush_callback, delay, settings.get('max_pending', 50))
+    
+    def mark_dirty(self):
+        """Отметить изменение и запланировать сброс"""
+        self.pending += 1
+        if self.delay <= 0 or self.pending >= self.max_pending:
+            self.flush()
+            return
+        
+        if self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+                return
+            self._timer = loop.call_later(self.delay, self.flush)
+    
+    def flush(self):
+        """Немедленно записать накопленные изменения"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending:
+            return
+        self.pending = 0
+        self.flush_callback()
+
+class PriorityGate:
+    """Семафор, который отдает освободившиеся места по приоритету (затем по очереди)"""
+    def __init__(self, slots: int):
+        self._free = slots
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+    
+    async def acquire(self, priority: int):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Место уже было выдано, но ожидающий отменен - возвращаем его
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+    
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._free += 1
+    
+    def __len__(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+# Роли, уже определенные в текущем обновлении (ставится планировщиком обновлений)
+role_memo: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar('role_memo', default=None)
+
 class Config:
     def __init__(self, config_file: str = CONFIG_FILE):
         self.config_file = config_file
+        # Сигнатура файла после последнего чтения или записи самим ботом
+        self._signature = file_signature(config_file)
         self.config = self.load_config()
+        self._roles = self._compile_roles()
+        # Общее хранилище конфига (режим shared_state) и последние значения, записанные в него
+        self._store = None
+        self._synced: Dict[str, str] = {}
+        self._writer = WriteBehind.from_settings(self._write_config, self.config.get('write_behind'))
+        # Изменения конфига из обработчиков, между которыми есть await
+        self.lock = asyncio.Lock()
         self.ensure_images_folder()
     
     def ensure_images_folder(self):
@@ -109,45 +382,157 @@ class Config:
         return DEFAULT_CONFIG.copy()
     
     def save_config(self):
-        """Сохранение конфигурации"""
+        """Сохранение конфигурации (с отложенной записью на диск)"""
+        self._roles = self._compile_roles()
+        self._writer.mark_dirty()
+    
+    def flush(self):
+        """Записать отложенные изменения конфигурации"""
+        self._writer.flush()
+    
+    def attach_store(self, store):
+        """Хранить конфиг в общей базе вместо файла (режим shared_state).
+        
+        Первый запуск заполняет общую копию из файла конфига,
+        следующие берут настройки из базы.
+        """
+        self._store = store
+        shared = store.load_shared_config()
+        if shared:
+            self.apply_shared_config(shared)
+        else:
+            self._write_config()
+            logger.info("Конфиг перенесен в общую базу")
+    
+    def apply_shared_config(self, values: Dict[str, str]) -> set:
+        """Применить настройки, измененные в общей базе (JSON по именам).
+        
+        Возвращает имена изменившихся настроек.
+        """
+        new_values = {}
+        for key, text in values.items():
+            self._synced[key] = text
+            new_values[key] = json.loads(text)
+        return self._apply_changes(new_values, "из общей базы")
+    
+    def _write_config(self):
+        """Запись конфигурации в файл (или в общую базу - только изменившиеся настройки)"""
+        if self._store is not None:
+            try:
+                values = {}
+                for key, value in self.config.items():
+                    text = json.dumps(value, ensure_ascii=False, sort_keys=True)
+                    if self._synced.get(key) != text:
+                        values[key] = text
+                if values:
+                    self._store.save_shared_config(values)
+                    self._synced.update(values)
+            except Exception as e:
+                logger.error(f"Ошибка сохранения конфига в общую базу: {e}")
+            return
+        
         try:
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 json.dump(self.config, f, ensure_ascii=False, indent=2)
+            self._signature = file_signature(self.config_file)
         except Exception as e:
             logger.error(f"Ошибка сохранения конфига: {e}")
     
-    def get_user_role(self, user_id: int) -> UserRole:
-        """Получение роли пользователя"""
+    def reload_if_changed(self) -> set:
+        """Перечитать файл конфига, если его изменили в обход бота.
+        
+        Собственные записи узнаются по сигнатуре файла. Меняются только
+        отличающиеся настройки; возвращает их имена.
+        """
+        if self._store is not None:
+            # В общем режиме файл - только начальная копия, изменения идут через базу
+            return set()
+        signature = file_signature(self.config_file)
+        if signature is None or signature == self._signature:
+            return set()
+        
+        # Запоминаем сразу: битый файл не перечитываем, пока его снова не изменят
+        self._signature = signature
         try:
-            user_id_int = int(user_id) if isinstance(user_id, str) and user_id.isdigit() else user_id
-            
-            if user_id_int == self.config['owner_id']:
-                return UserRole.OWNER
-            elif user_id_int in self.config['special_admins']:
-                return UserRole.SPECIAL_ADMIN
-            elif user_id_int in self.config['admins']:
-                return UserRole.ADMIN
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                loaded_config = json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка перечитывания конфига, оставлены прежние настройки: {e}")
+            return set()
+        
+        new_config = DEFAULT_CONFIG.copy()
+        new_config.update(loaded_config)
+        return self._apply_changes(new_config, "с диска", complete=True)
+    
+    def _apply_changes(self, new_values: Dict, source: str, complete: bool = False) -> set:
+        """Заменить отличающиеся настройки и пересобрать то, что от них зависит.
+        
+        complete - new_values содержит весь конфиг, отсутствующие в нем
+        настройки удаляются. Возвращает имена изменившихся настроек.
+        """
+        keys = new_values.keys() | self.config.keys() if complete else new_values.keys()
+        changed = {key for key in keys if new_values.get(key) != self.config.get(key)}
+        if not changed:
+            return changed
+        
+        if self._writer.pending:
+            logger.warning(f"Конфиг изменен извне до записи изменений бота, они заменены версией {source}")
+        for key in changed:
+            if key in new_values:
+                self.config[key] = new_values[key]
             else:
-                return UserRole.USER
-        except (ValueError, TypeError):
-            return UserRole.USER
+                del self.config[key]
+        if changed & {'owner_id', 'special_admins', 'admins'}:
+            self._roles = self._compile_roles()
+        if 'write_behind' in changed:
+            self._writer.flush()
+            self._writer = WriteBehind.from_settings(self._write_config, self.config.get('write_behind'))
+        
+        logger.info(f"Конфиг обновлен {source}, изменены: {', '.join(sorted(changed))}")
+        return changed
+    
+    def _compile_roles(self) -> MappingProxyType:
+        """Собрать неизменяемую таблицу ID -> роль из списков конфига.
+        
+        Таблица заменяется целиком, поэтому проверки прав никогда не видят
+        ее наполовину обновленной.
+        """
+        roles = {}
+        for role, ids in ((UserRole.ADMIN, self.config.get('admins') or []),
+                          (UserRole.SPECIAL_ADMIN, self.config.get('special_admins') or []),
+                          (UserRole.OWNER, [self.config.get('owner_id')])):
+            for raw_id in ids:
+                try:
+                    roles[int(raw_id)] = role
+                except (ValueError, TypeError):
+                    logger.warning(f"Некорректный ID в списке ролей конфига: {raw_id!r}")
+        return MappingProxyType(roles)
+    
+    def get_user_role(self, user_id: int) -> UserRole:
+        """Получение роли пользователя.
+        
+        Внутри обработки обновления роль запоминается (role_memo): все проверки
+        одного обновления видят одну и ту же роль.
+        """
+        memo = role_memo.get()
+        if memo is not None and user_id in memo:
+            return memo[user_id]
+        
+        try:
+            role = self._roles.get(user_id)
+            if role is None and isinstance(user_id, str) and user_id.isdigit():
+                role = self._roles.get(int(user_id))
+        except TypeError:
+            role = None
+        role = role or UserRole.USER
+        
+        if memo is not None:
+            memo[user_id] = role
+        return role
     
     def is_admin(self, user_id: int) -> bool:
         """Проверка, является ли пользователь администратором"""
-        try:
-            if isinstance(user_id, str):
-                if user_id.isdigit():
-                    user_id_int = int(user_id)
-                else:
-                    return False
-            else:
-                user_id_int = user_id
-            
-            user_role = self.get_user_role(user_id_int)
-            return user_role in [UserRole.ADMIN, UserRole.SPECIAL_ADMIN, UserRole.OWNER]
-        except Exception as e:
-            logger.error(f"Ошибка проверки админа: {e}")
-            return False
+        return self.get_user_role(user_id) is not UserRole.USER
     
     def is_admin_chat(self, chat_id: int) -> bool:
         """Проверка, является ли чат админ-чатом"""
@@ -175,6 +560,7 @@ class Config:
                 self.config['special_admins'].append(user_id_int)
             
             self.save_config()
+            self._forget_memo_roles()
             return True, "Успешно добавлен"
         except Exception as e:
             logger.error(f"Ошибка добавления админа: {e}")
@@ -198,6 +584,7 @@ class Config:
             
             if removed:
                 self.save_config()
+                self._forget_memo_roles()
                 return True, "Администратор удален"
             else:
                 return False, "Пользователь не является администратором"
@@ -205,6 +592,13 @@ class Config:
             logger.error(f"Ошибка удаления админа: {e}")
             return False, f"Ошибка: {str(e)}"
     
+    @staticmethod
+    def _forget_memo_roles():
+        """Сбросить роли, запомненные текущим обновлением (оно само их изменило)"""
+        memo = role_memo.get()
+        if memo:
+            memo.clear()
+    
     def list_admins(self) -> Dict[str, List[int]]:
         """Получить список всех администраторов"""
         return {
@@ -213,10 +607,32 @@ class Config:
             'admins': self.config['admins']
         }
     
-    def update_image_file(self, image_type: str, file_path: str):
-        """Обновление пути к файлу картинки"""
+    def update_image_file(self, image_type: str, file_path: str, file_id: str = None):
+        """Обновление пути к файлу картинки (старый file_id сбрасывается)"""
         if image_type in self.config['images']:
             self.config['images'][image_type] = file_path
+            if file_id:
+                self.set_image_file_id(image_type, file_id)
+            else:
+                self.invalidate_image_file_id(image_type)
+            self.save_config()
+    
+    def get_image_file_id(self, image_type: str) -> Optional[str]:
+        """Получить сохраненный file_id картинки, если он относится к текущему файлу"""
+        entry = self.config.get('image_file_ids', {}).get(image_type)
+        if entry and entry.get('path') == self.config['images'].get(image_type):
+            return entry.get('file_id')
+        return None
+    
+    def set_image_file_id(self, image_type: str, file_id: str):
+        """Запомнить file_id, выданный Telegram для картинки"""
+        file_ids = self.config.setdefault('image_file_ids', {})
+        file_ids[image_type] = {'path': self.config['images'].get(image_type), 'file_id': file_id}
+        self.save_config()
+    
+    def invalidate_image_file_id(self, image_type: str):
+        """Забыть file_id картинки"""
+        if self.config.get('image_file_ids', {}).pop(image_type, None):
             self.save_config()
     
     def get_image_file(self, image_type: str) -> Optional[str]:
@@ -253,6 +669,46 @@ class Config:
         self.config['check_subscription'] = enabled
         self.save_config()
 
+class TTLCache:
+    """Ограниченный кэш (LRU) со временем жизни записей и счетчиками попаданий"""
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()  # ключ -> (истекает, значение)
+    
+    def get(self, key) -> Tuple[bool, object]:
+        """Вернуть (найдено, значение); просроченные записи удаляются"""
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+        
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, item[1]
+    
+    def set(self, key, value, ttl: float = None):
+        """Сохранить значение (ttl по умолчанию - общий для кэша)"""
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+    
+    def invalidate(self, key):
+        """Удалить запись из кэша"""
+        self._data.pop(key, None)
+    
+    def clear(self):
+        """Очистить кэш"""
+        self._data.clear()
+    
+    def __len__(self) -> int:
+        return len(self._data)
+
 class TelegramUserAPI:
     """Класс для работы с Telegram User API (через Telethon)"""
     def __init__(self, api_id: int, api_hash: str):
@@ -261,6 +717,16 @@ class TelegramUserAPI:
         self.session_name = os.path.join(SCRIPT_DIR, 'telegram_session')
         self.client = None
         self.is_connected = False
+        # Кэш по нормализованному идентификатору; None означает "не найден"
+        self.cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        # Запросы, которые сейчас выполняются: повторные ждут их результат
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced = 0
+        # Пачка числовых ID, ожидающих одного общего GetUsersRequest
+        self._id_batch: Dict[int, List[asyncio.Future]] = {}
+        self._batch_timer = None
+        self.batches_sent = 0
+        self.batched_ids = 0
         
     async def connect(self):
         """Подключиться к Telegram API"""
@@ -289,98 +755,1941 @@ class TelegramUserAPI:
     async def get_user_info(self, identifier: str):
         """Получить информацию о пользователе по username или ID"""
         try:
-            if not self.is_connected:
-                if not await self.connect():
-                    return None
-            
             clean_identifier = identifier.replace('@', '').strip()
+            cache_key = clean_identifier.lower()
             
-            if clean_identifier.isdigit():
-                try:
-                    user_id = int(clean_identifier)
-                    users = await self.client(GetUsersRequest([user_id]))
-                    
-                    if users and len(users) > 0:
-                        user = users[0]
-                        if isinstance(user, User):
-                            return self._format_user_info(user)
-                except Exception as e:
-                    logger.debug(f"Не удалось получить по ID {clean_identifier}: {e}")
+            found, cached = self.cache.get(cache_key)
+            if found:
+                return cached
             
+            pending = self._inflight.get(cache_key)
+            if pending is None:
+                pending = asyncio.ensure_future(self._lookup_user_info(clean_identifier, cache_key))
+                self._inflight[cache_key] = pending
+                pending.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+            else:
+                self.coalesced += 1
+            
+            # shield: отмена одного ожидающего не должна отменять общий запрос
+            return await asyncio.shield(pending)
+            
+        except Exception as e:
+            logger.error(f"Ошибка в get_user_info для {identifier}: {e}")
+            return None
+    
+    async def _lookup_user_info(self, clean_identifier: str, cache_key: str) -> Optional[Dict]:
+        """Запрос в Telegram с сохранением результата в кэш"""
+        if not self.is_connected:
+            if not await self.connect():
+                return None
+        
+        user_info, definitive = await self._fetch_user_info(clean_identifier)
+        if user_info:
+            self.cache.set(cache_key, user_info)
+        elif definitive:
+            self.cache.set(cache_key, None, USER_CACHE_NEGATIVE_TTL)
+        return user_info
+    
+    async def _fetch_user_info(self, clean_identifier: str) -> Tuple[Optional[Dict], bool]:
+        """Запросить пользователя в Telegram.
+        
+        Возвращает (информация, ответ_окончательный). Если пользователь не
+        найден из-за сетевой ошибки или FloodWait, ответ не окончательный и
+        кэшировать "не найден" нельзя.
+        """
+        definitive = True
+        
+        if clean_identifier.isdigit():
+            try:
+                user = await self._get_user_by_id(int(clean_identifier))
+                if isinstance(user, User):
+                    return self._format_user_info(user), True
+            except Exception as e:
+                definitive = definitive and self._is_not_found_error(e)
+                logger.debug(f"Не удалось получить по ID {clean_identifier}: {e}")
+        
+        try:
+            user = await self.client.get_entity(f"@{clean_identifier}")
+            if isinstance(user, User):
+                return self._format_user_info(user), True
+        except Exception as e:
+            definitive = definitive and self._is_not_found_error(e)
+            logger.debug(f"Не удалось получить по username {clean_identifier}: {e}")
             try:
-                user = await self.client.get_entity(f"@{clean_identifier}")
+                user = await self.client.get_entity(clean_identifier)
                 if isinstance(user, User):
-                    return self._format_user_info(user)
+                    return self._format_user_info(user), True
+            except Exception as e2:
+                definitive = definitive and self._is_not_found_error(e2)
+                logger.debug(f"Не удалось получить по clean_identifier {clean_identifier}: {e2}")
+        
+        return None, definitive
+    
+    def _get_user_by_id(self, user_id: int) -> asyncio.Future:
+        """Поставить ID в очередь на пакетный GetUsersRequest.
+        
+        Запросы, пришедшие в течение USER_BATCH_WINDOW, уходят одним вызовом
+        (не больше USER_BATCH_SIZE ID). Результат - User или None.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._id_batch.setdefault(user_id, []).append(future)
+        
+        if len(self._id_batch) >= USER_BATCH_SIZE:
+            self._flush_id_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(USER_BATCH_WINDOW, self._flush_id_batch)
+        return future
+    
+    def _flush_id_batch(self):
+        """Отправить накопленную пачку ID"""
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if not self._id_batch:
+            return
+        
+        batch, self._id_batch = self._id_batch, {}
+        asyncio.ensure_future(self._send_id_batch(batch))
+    
+    async def _send_id_batch(self, batch: Dict[int, List[asyncio.Future]]):
+        """Выполнить GetUsersRequest для всей пачки и раздать результаты ожидающим.
+        
+        Сеть не трогается ни для одного ID по отдельности; второй запрос
+        (только с ID из кэша сессии) уходит, лишь если первый отклонен.
+        """
+        def resolve(futures, result=None, error=None):
+            for future in futures:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        
+        # access_hash берем из кэша сессии без запросов к сети; для остальных
+        # ID пробуем access_hash=0 (так делает и сам Telethon для одного ID)
+        cached, uncached = [], []
+        for user_id in batch:
+            input_user = self._cached_input_user(user_id)
+            if input_user is not None:
+                cached.append(input_user)
+            else:
+                uncached.append(InputUser(user_id, access_hash=0))
+        
+        input_users = cached + uncached
+        try:
+            self.batches_sent += 1
+            users = await self.client(GetUsersRequest(input_users))
+        except Exception as e:
+            if not (cached and uncached):
+                for futures in batch.values():
+                    resolve(futures, error=e)
+                return
+            # Неизвестный ID мог сломать весь запрос: повторяем только с
+            # кэшированными, остальные считаем не найденными
+            for input_user in uncached:
+                resolve(batch[input_user.user_id],
+                        error=ValueError(f"Нет access_hash для {input_user.user_id}"))
+            input_users = cached
+            try:
+                self.batches_sent += 1
+                users = await self.client(GetUsersRequest(input_users))
             except Exception as e:
-                logger.debug(f"Не удалось получить по username {clean_identifier}: {e}")
+                for futures in batch.values():
+                    resolve(futures, error=e)
+                return
+
+        self.batched_ids += len(input_users)
+        
+        found = {user.id: user for user in users if isinstance(user, User)}
+        for user_id, futures in batch.items():
+            resolve(futures, found.get(user_id))
+    
+    def _cached_input_user(self, user_id: int) -> Optional[InputUser]:
+        """InputUser из кэша сессии Telethon (без запросов к сети) или None"""
+        try:
+            return utils.get_input_user(self.client.session.get_input_entity(user_id))
+        except (ValueError, TypeError):
+            return None
+    
+    @staticmethod
+    def _is_not_found_error(error: Exception) -> bool:
+        """Ошибка означает, что такого пользователя нет (а не сбой запроса)"""
+        return isinstance(error, (ValueError, UsernameNotOccupiedError, UsernameInvalidError))
+    
+    def _format_user_info(self, user: User) -> Dict:
+        """Форматировать информацию о пользователе"""
+        username = user.username or ""
+        
+        if not username:
+            if user.first_name:
+                username = user.first_name
+                if user.last_name:
+                    username += f" {user.last_name}"
+            else:
+                username = f"id{user.id}"
+        
+        return {
+            'id': user.id,
+            'username': username,
+            'first_name': user.first_name or "",
+            'last_name': user.last_name or "",
+            'phone': user.phone or "",
+            'bot': user.bot,
+            'premium': getattr(user, 'premium', False),
+            'scam': getattr(user, 'scam', False),
+            'fake': getattr(user, 'fake', False),
+            'verified': getattr(user, 'verified', False)
+        }
+    
+    async def close(self):
+        """Закрыть соединение"""
+        if self.client and self.is_connected:
+            await self.client.disconnect()
+            self.is_connected = False
+            print("🔌 Telegram User API отключен")
+
+def _build_country_aliases() -> Dict[str, str]:
+    """Названия стран (с флагом и без) -> код"""
+    aliases = {'ес': 'EU', 'сша': 'US'}
+    for code, name in COUNTRY_NAMES.items():
+        aliases[name.lower()] = code
+        aliases[name.split(' ', 1)[-1].lower()] = code
+    return aliases
+
+COUNTRY_ALIASES = _build_country_aliases()
+
+def normalize_country(country: Optional[str]) -> Optional[str]:
+    """Привести страну к коду (RU, UA, ...).
+    
+    Понимает коды в любом регистре и названия, которые раньше сохранялись
+    в базу ("🇷🇺 Россия", "Россия", "Страна XX").
+    """
+    if not country:
+        return None
+    value = str(country).strip()
+    if value.lower().startswith('страна '):
+        value = value[len('страна '):].strip()
+    if value.upper() in COUNTRY_NAMES or (len(value) == 2 and value.isalpha()):
+        return value.upper()
+    return COUNTRY_ALIASES.get(value.lower(), value)
+
+def country_display(country: Optional[str]) -> Optional[str]:
+    """Название страны для показа пользователю"""
+    code = normalize_country(country)
+    if not code:
+        return None
+    return COUNTRY_NAMES.get(code, code)
+
+def normalize_username(username: Optional[str]) -> str:
+    """Привести username к виду для сравнения: без @ и в нижнем регистре"""
+    return (username or '').replace('@', '').lower()
+
+def make_scammer_record(user_id: str, username: str, reason: str, added_by: int,
+                        chat_id: int = None, country: str = None, proof_link: str = None) -> Dict:
+    """Создать новую запись скамера"""
+    return {
+        'username': username,
+        'user_id': user_id,
+        'reasons': [reason],
+        'country': normalize_country(country),
+        'scam_chance': 100,
+        'proofs': [proof_link] if proof_link else [],
+        'added_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'added_by': added_by,
+        'added_from_chat': chat_id,
+        'reports': 1,
+        'status': 'active'
+    }
+
+def merge_scammer_report(user_data: Dict, username: str, reason: str, proof_link: str = None) -> Dict:
+    """Добавить повторную жалобу к активной записи скамера"""
+    existing_reasons = user_data.get('reasons', [])
+    if reason not in existing_reasons:
+        existing_reasons.append(reason)
+        user_data['reasons'] = existing_reasons
+    
+    user_data['reports'] = user_data.get('reports', 0) + 1
+    
+    if proof_link:
+        proofs = user_data.get('proofs', [])
+        if proof_link not in proofs:
+            proofs.append(proof_link)
+            user_data['proofs'] = proofs
+    
+    if username and username != user_data.get('username'):
+        user_data['username'] = username
+    
+    return user_data
+
+def merge_imported_entry(user_data: Optional[Dict], entry: Dict, added_by: int) -> Tuple[Dict, bool]:
+    """Слить запись из импорта с записью базы по правилам add_scammer.
+    
+    К активной записи добавляются новые причины и доказательства, а жалобы
+    суммируются; иначе создается новая запись. Возвращает (запись, новая_ли).
+    """
+    reasons = entry['reasons']
+    if user_data and user_data.get('status') == 'active':
+        # у строки только с ID вместо имени заглушка id<user_id> - имя из базы не трогаем
+        username = entry['username'] if entry['username'] != f"id{entry['user_id']}" else None
+        for reason in reasons:
+            merge_scammer_report(user_data, username, reason)
+        # merge_scammer_report считает каждую причину жалобой - приводим к числу из импорта
+        user_data['reports'] = user_data.get('reports', 0) + entry['reports'] - len(reasons)
+        if username:
+            user_data['username'] = username
+        for proof in entry['proofs']:
+            if proof not in user_data.setdefault('proofs', []):
+                user_data['proofs'].append(proof)
+        if entry['country'] and not user_data.get('country'):
+            user_data['country'] = entry['country']
+        return user_data, False
+    
+    user_data = make_scammer_record(entry['user_id'], entry['username'], 'Импорт', added_by,
+                                    country=entry['country'])
+    user_data['reasons'] = list(dict.fromkeys(reasons)) or ['Импорт']
+    user_data['proofs'] = list(dict.fromkeys(entry['proofs']))
+    user_data['reports'] = entry['reports']
+    if entry['added_date']:
+        user_data['added_date'] = entry['added_date']
+    return user_data, True
+
+def normalize_import_entry(key: Optional[str], raw) -> Optional[Dict]:
+    """Привести запись из файла импорта к единому виду (None - запись не годится).
+    
+    Понимает поля user_id/id, username, reasons/reason, proofs/proof/proof_link,
+    reports, country, added_date и status (удаленные записи пропускаются).
+    """
+    if not isinstance(raw, dict) or raw.get('status') == 'removed':
+        return None
+    
+    def as_list(*names) -> List[str]:
+        values = []
+        for name in names:
+            value = raw.get(name)
+            if isinstance(value, list):
+                values.extend(str(item).strip() for item in value)
+            elif value:
+                values.append(str(value).strip())
+        return [value for value in values if value]
+    
+    username = str(raw.get('username') or '').strip().lstrip('@')
+    user_id = str(raw.get('user_id') or raw.get('id') or key or '').strip()
+    if not user_id:
+        user_id = username
+    if not user_id:
+        return None
+    
+    reasons = as_list('reasons', 'reason')
+    try:
+        reports = max(1, int(raw.get('reports') or len(reasons) or 1))
+    except (TypeError, ValueError):
+        reports = max(1, len(reasons))
+    
+    added_date = str(raw.get('added_date') or '')
+    if not re.fullmatch(r'\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2})?', added_date):
+        added_date = ''
+    
+    return {
+        'user_id': user_id,
+        'username': username or (user_id if not user_id.isdigit() else f"id{user_id}"),
+        'reasons': reasons,
+        'proofs': as_list('proofs', 'proof', 'proof_link'),
+        'reports': reports,
+        'country': normalize_country(raw.get('country')),
+        'added_date': added_date,
+    }
+
+def iter_json_entries(f):
+    """Потоково разобрать JSON-массив записей или объект {ключ: запись}.
+    
+    Файл читается кусками, в памяти держится только текущая запись.
+    Возвращает пары (ключ или None, запись).
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        chunk = f.read(IMPORT_READ_CHUNK)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        eof = not chunk
+        return bool(chunk)
+    
+    def skip(chars: str):
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+            if pos < len(buffer) or not fill():
+                return
+    
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # Число или литерал на границе куска могли обрезаться - дочитываем
+                if end < len(buffer) or eof or isinstance(value, (dict, list, str)):
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+    
+    skip(' \t\r\n')
+    if pos >= len(buffer):
+        return
+    opening = buffer[pos]
+    if opening not in '[{':
+        raise ValueError("Ожидался JSON-массив или объект")
+    pos += 1
+    closing = ']' if opening == '[' else '}'
+    
+    while True:
+        skip(' \t\r\n,')
+        if pos >= len(buffer):
+            raise ValueError("Файл JSON оборвался")
+        if buffer[pos] == closing:
+            return
+        key = None
+        if opening == '{':
+            key = decode()
+            skip(' \t\r\n')
+            if pos >= len(buffer) or buffer[pos] != ':':
+                raise ValueError(f"Ожидалось ':' после ключа {key!r}")
+            pos += 1
+            skip(' \t\r\n')
+        yield key, decode()
+
+JSON_TOKEN_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+JSON_COLON_RE = re.compile(rb'\s*:')
+
+def iter_json_object_spans(buffer):
+    """Найти записи-объекты верхнего JSON-объекта прямо в байтах (например, в mmap).
+    
+    Файл не декодируется и не копируется: просматриваются только строки и
+    скобки. Возвращает тройки (ключ, начало, конец) для значений-объектов;
+    значения других типов пропускаются.
+    """
+    depth = 0
+    key = None
+    start = None
+    for match in JSON_TOKEN_RE.finditer(buffer):
+        token = match.group()
+        if token in (b'{', b'['):
+            if depth == 0 and token != b'{':
+                raise ValueError("Ожидался JSON-объект")
+            depth += 1
+            if depth == 2 and token == b'{' and key is not None:
+                start = match.start()
+        elif token in (b'}', b']'):
+            depth -= 1
+            if depth == 1:
+                if start is not None:
+                    yield key, start, match.end()
+                key = start = None
+            elif depth == 0:
+                return
+        elif depth == 1:
+            # Строка верхнего уровня - ключ, если за ней двоеточие, иначе значение
+            key = json.loads(token) if JSON_COLON_RE.match(buffer, match.end()) else None
+    if depth:
+        raise ValueError("Файл JSON оборвался")
+
+def iter_ndjson_entries(f):
+    """Записи из NDJSON (по одному JSON-объекту в строке)"""
+    for line in f:
+        line = line.strip()
+        if line:
+            yield None, json.loads(line)
+
+def iter_csv_entries(f):
+    """Записи из CSV с заголовком (колонки как у полей записи)"""
+    for row in csv.DictReader(f):
+        yield None, {name.strip().lower(): value for name, value in row.items() if name}
+
+def iter_import_entries(f, file_name: str = ''):
+    """Выбрать разборщик по расширению файла (или по первой строке)"""
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension == '.csv':
+        return iter_csv_entries(f)
+    if extension in ('.ndjson', '.jsonl'):
+        return iter_ndjson_entries(f)
+    if extension != '.json':
+        first_line = f.readline()
+        f.seek(0)
+        stripped = first_line.strip()
+        if not stripped.startswith(('[', '{')):
+            return iter_csv_entries(f)
+        if stripped.startswith('{'):
+            try:
+                json.loads(stripped)
+                return iter_ndjson_entries(f)
+            except ValueError:
+                pass
+    return iter_json_entries(f)
+
+def make_meta_filter(status: Optional[str] = 'active', country: str = None,
+                     date_from: str = None, date_to: str = None,
+                     min_reports: int = None, max_reports: int = None):
+    """Проверка мета-информации записи по условиям поиска (как в search)"""
+    country = normalize_country(country) if country else None
+    date_to = date_to + '\uffff' if date_to else None
+    
+    def matches(meta: Dict) -> bool:
+        if status and meta.get('status') != status:
+            return False
+        if country and normalize_country(meta.get('country')) != country:
+            return False
+        added_date = meta.get('added_date') or ''
+        if (date_from and added_date < date_from) or (date_to and added_date > date_to):
+            return False
+        reports = meta.get('reports') or 0
+        if (min_reports is not None and reports < min_reports) or \
+                (max_reports is not None and reports > max_reports):
+            return False
+        return True
+    
+    return matches
+
+def write_export_file(path: str, fmt: str, records) -> int:
+    """Записать записи по одной в сжатый gzip файл NDJSON или CSV.
+    
+    Страна выгружается кодом, даже если в записи осталось старое название.
+    Вызывается из потока; возвращает число записей.
+    """
+    def normalized(record: Dict) -> Dict:
+        if record.get('country'):
+            return dict(record, country=normalize_country(record['country']))
+        return record
+    
+    count = 0
+    records = map(normalized, records)
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_CSV_FIELDS)
+            for record in records:
+                row = []
+                for field in EXPORT_CSV_FIELDS:
+                    value = record.get(field)
+                    if isinstance(value, list):
+                        value = ' | '.join(str(item) for item in value)
+                    row.append('' if value is None else value)
+                writer.writerow(row)
+                count += 1
+        else:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+    return count
+
+def make_recent_cursor(added_date: str, user_id: str) -> str:
+    """Курсор постраничного вывода последних скамеров"""
+    return f"{added_date}|{user_id}"
+
+def parse_recent_cursor(cursor: str) -> Tuple[str, str]:
+    """Разобрать курсор в пару (added_date, ключ)"""
+    added_date, _, user_id = cursor.partition('|')
+    return added_date, user_id
+
+def fold_username(username: Optional[str]) -> str:
+    """Нормализованный username со сложенными похожими символами (I/l/1, 0/O и т.п.)"""
+    return normalize_username(username).translate(HOMOGLYPHS)
+
+def edit_distance(a: str, b: str) -> int:
+    """Расстояние Левенштейна между строками"""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b)
+            ))
+        previous = current
+    return previous[-1]
+
+class FuzzyIndex:
+    """Индекс похожих username по триграммам сложенных имен.
+    
+    Кандидаты отбираются по числу общих триграмм (порог считается по
+    наборам триграмм обоих имен), затем проверяются расстоянием Левенштейна.
+    Вхождение одного имени в другое (Stepa5553 и 5553) тоже считается
+    совпадением. Обновляется по одной записи.
+    """
+    def __init__(self):
+        self._keys: Dict[str, set] = {}  # сложенное имя -> ключи записей
+        self._grams: Dict[str, set] = {}  # триграмма -> сложенные имена
+        self._sizes: Dict[str, int] = {}  # сложенное имя -> число его триграмм
+    
+    @staticmethod
+    def _trigrams(name: str) -> set:
+        # Границы имени тоже дают триграммы: так у коротких имен остаются
+        # общие триграммы даже при правке в середине
+        padded = f"^{name}$"
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+    
+    def add(self, username: Optional[str], key: str):
+        name = fold_username(username)
+        if not name:
+            return
+        keys = self._keys.get(name)
+        if keys is None:
+            keys = self._keys[name] = set()
+            grams = self._trigrams(name)
+            self._sizes[name] = len(grams)
+            for gram in grams:
+                self._grams.setdefault(gram, set()).add(name)
+        keys.add(key)
+    
+    def remove(self, username: Optional[str], key: str):
+        name = fold_username(username)
+        keys = self._keys.get(name)
+        if keys is None:
+            return
+        keys.discard(key)
+        if keys:
+            return
+        del self._keys[name]
+        del self._sizes[name]
+        for gram in self._trigrams(name):
+            names = self._grams.get(gram)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._grams[gram]
+    
+    def search(self, username: str, limit: int = FUZZY_SUGGESTIONS,
+               exclude: Optional[set] = None) -> List[Tuple[str, int]]:
+        """Ключи записей с похожими именами: [(ключ, расстояние)] от близких к дальним"""
+        query = fold_username(username)
+        grams = self._trigrams(query)
+        if len(query) < FUZZY_MIN_LENGTH or not grams:
+            return []
+        
+        # Слишком частые триграммы почти ничего не отсеивают, но дороже всего
+        # обходятся при подсчете; если редких нет, берем самую редкую
+        postings = sorted((self._grams.get(gram, set()) for gram in grams), key=len)
+        usable = [names for names in postings if len(names) <= FUZZY_MAX_POSTINGS] or postings[:1]
+        
+        # Общие триграммы из пропущенных частых не посчитаны - порог снижаем на их число
+        skipped = len(grams) - len(usable)
+        shared = Counter()
+        for names in usable:
+            shared.update(names)
+        
+        def max_distance(name: str) -> int:
+            return max(1, min(len(name), len(query)) // 4)
+        
+        def needed(name: str) -> int:
+            size = self._sizes[name]
+            # Одна правка портит не больше трех триграмм в каждом имени, поэтому
+            # имена на расстоянии d делят хотя бы max(размеров) - 3 * d триграмм
+            threshold = max(len(grams), size) - 3 * max_distance(name)
+            if min(len(name), len(query)) >= FUZZY_MIN_LENGTH:
+                # Имя внутри другого делит с ним все свои триграммы, кроме двух граничных
+                threshold = min(threshold, min(len(grams), size) - 2)
+            return max(1, threshold - skipped)
+        
+        # При равном числе общих триграмм ближе те, что ближе по длине
+        candidates = heapq.nlargest(
+            FUZZY_MAX_CANDIDATES,
+            ((count, -abs(len(name) - len(query)), name)
+             for name, count in shared.items() if count >= needed(name))
+        )
+        
+        matches = []
+        for _, _, name in candidates:
+            distance = edit_distance(query, name)
+            too_far = distance > max_distance(name)
+            contained = min(len(name), len(query)) >= FUZZY_MIN_LENGTH and (name in query or query in name)
+            if not too_far or contained:
+                matches.append((too_far, distance, name))
+        matches.sort()
+        
+        results = []
+        for _, distance, name in matches:
+            for key in sorted(self._keys[name]):
+                if exclude and key in exclude:
+                    continue
+                results.append((key, distance))
+                if len(results) >= limit:
+                    return results
+        return results
+
+class RecordStore(MutableMapping):
+    """Записи базы с ленивым декодированием из memory-mapped снапшота.
+
+    Для каждого ключа в памяти держится только короткая мета-информация
+    (username, статус, жалобы, дата, страна), по которой строятся индексы.
+    Полная запись декодируется из снапшота при первом обращении; изменённые
+    и новые записи хранятся в памяти до следующего сжатия базы.
+    """
+    META_FIELDS = ('username', 'status', 'reports', 'added_date', 'country')
+    CACHE_SIZE = 1024  # сколько неизменённых декодированных записей держать в памяти
+    
+    def __init__(self, records: Optional[Dict] = None):
+        self._meta: Dict[str, Dict] = {}
+        self._spans: Dict[str, Tuple[int, int]] = {}  # ключ -> (смещение, длина) в снапшоте
+        self._records: Dict[str, Dict] = {}  # изменённые/новые записи
+        self._cache: OrderedDict = OrderedDict()  # декодированные неизменённые записи
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._changed_at: Dict[str, int] = {}  # ключ -> номер последнего изменения
+        self._change_seq = 0
+        self._mm = None
+        self._pins = 0  # сколько чтений из потоков держат текущее отображение
+        self._retired: List[mmap.mmap] = []  # замененные отображения, которые еще читаются
+        for key, info in (records or {}).items():
+            self[key] = info
+    
+    @classmethod
+    def make_meta(cls, info: Dict) -> Dict:
+        """Мета-информация записи для индексов (страна - кодом, даже у старых записей)"""
+        meta = {field: info.get(field) for field in cls.META_FIELDS}
+        meta['country'] = normalize_country(meta['country'])
+        return meta
+    
+    @classmethod
+    def open_snapshot(cls, db_file: str, index: Dict) -> 'RecordStore':
+        """Открыть снапшот по готовому индексу без декодирования записей"""
+        store = cls()
+        with open(db_file, 'rb') as f:
+            store._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for key, (offset, length, meta) in index['records'].items():
+            store._meta[key] = meta
+            store._spans[key] = (offset, length)
+        return store
+    
+    def meta(self, key: str) -> Dict:
+        """Мета-информация записи (пустой словарь, если записи нет)"""
+        return self._meta.get(key, {})
+    
+    def iter_meta(self):
+        """Мета-информация всех записей без декодирования"""
+        return self._meta.values()
+    
+    def __contains__(self, key) -> bool:
+        return key in self._meta
+    
+    def __len__(self) -> int:
+        return len(self._meta)
+    
+    def __iter__(self):
+        return iter(list(self._meta))
+    
+    def __getitem__(self, key: str) -> Dict:
+        if key in self._records:
+            return self._records[key]
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self._cache_hits += 1
+            return self._cache[key]
+        if key not in self._meta:
+            raise KeyError(key)
+        
+        offset, length = self._spans[key]
+        info = json.loads(self._mm[offset:offset + length])
+        self._cache_misses += 1
+        self._cache[key] = info
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return info
+    
+    def __setitem__(self, key: str, info: Dict):
+        self._cache.pop(key, None)
+        self._records[key] = info
+        self._meta[key] = self.make_meta(info)
+        self._change_seq += 1
+        self._changed_at[key] = self._change_seq
+    
+    def __delitem__(self, key: str):
+        if key not in self._meta:
+            raise KeyError(key)
+        del self._meta[key]
+        self._records.pop(key, None)
+        self._cache.pop(key, None)
+        # span удаленной записи остается: по нему читается snapshot_record
+        self._change_seq += 1
+        self._changed_at[key] = self._change_seq
+    
+    def cache_stats(self) -> Dict:
+        """Кэш декодированных записей снапшота: {'size', 'hits', 'misses'}"""
+        return {'size': len(self._cache), 'hits': self._cache_hits, 'misses': self._cache_misses}
+    
+    def snapshot_record(self, key: str) -> Optional[Dict]:
+        """Запись в том виде, в каком она лежит в снапшоте (без изменений в памяти)"""
+        span = self._spans.get(key)
+        if span is None or self._mm is None:
+            return None
+        offset, length = span
+        return json.loads(self._mm[offset:offset + length])
+    
+    def snapshot_entries(self) -> Tuple[int, List[Tuple]]:
+        """Зафиксировать состояние для записи снапшота.
+        
+        Возвращает номер последнего изменения и список
+        (ключ, span или копия записи, мета). Вызывать из event loop.
+        """
+        entries = []
+        for key, meta in self._meta.items():
+            if key in self._records:
+                # Глубокая копия: обработчики меняют списки записи на месте
+                entries.append((key, copy.deepcopy(self._records[key]), dict(meta)))
+            else:
+                entries.append((key, self._spans[key], dict(meta)))
+        return self._change_seq, entries
+    
+    @contextlib.contextmanager
+    def pinned_snapshot(self):
+        """Зафиксировать состояние для чтения из потока.
+        
+        Отдает (номер изменения, записи, отображение снапшота). Пока
+        состояние закреплено, замена снапшота не закрывает старое отображение.
+        """
+        seq, entries = self.snapshot_entries()
+        mm = self._mm
+        self._pins += 1
+        try:
+            yield seq, entries, mm
+        finally:
+            self._pins -= 1
+            if not self._pins:
+                for old_mm in self._retired:
+                    old_mm.close()
+                self._retired = []
+    
+    async def wait_unpinned(self):
+        """Дождаться, пока потоки дочитают закрепленный снапшот"""
+        while self._pins:
+            await asyncio.sleep(0.05)
+    
+    @staticmethod
+    def read_entry(source, mm) -> Dict:
+        """Запись из элемента snapshot_entries (копия или span в отображении mm)"""
+        if isinstance(source, dict):
+            return source
+        offset, length = source
+        return json.loads(mm[offset:offset + length])
+    
+    def write_snapshot(self, path: str, entries, mm=None) -> Dict:
+        """Записать снапшот (один объект JSON, по записи на строку).
+        
+        entries - любой итерируемый набор (ключ, span или запись, мета).
+        Неизменённые записи копируются байтами из снапшота mm (по умолчанию
+        текущего). Возвращает индекс нового файла. Безопасно вызывать из потока.
+        """
+        mm = mm if mm is not None else self._mm
+        records_index = {}
+        with open(path, 'wb') as f:
+            f.write(b'{')
+            for i, (key, source, meta) in enumerate(entries):
+                if isinstance(source, dict):
+                    body = json.dumps(source, ensure_ascii=False).encode('utf-8')
+                else:
+                    offset, length = source
+                    body = mm[offset:offset + length]
+                
+                f.write((b',\n' if i else b'\n') + json.dumps(key, ensure_ascii=False).encode('utf-8') + b': ')
+                records_index[key] = (f.tell(), len(body), meta)
+                f.write(body)
+            f.write(b'\n}\n')
+        return {'records': records_index}
+    
+    def swap_snapshot(self, db_file: str, new_file: str, index: Dict, snapshot_seq: int):
+        """Заменить файл снапшота и перевести записи на новые смещения.
+        
+        Записи, изменённые после snapshot_seq, остаются в памяти. Вызывать,
+        когда снапшот не закреплен (см. wait_unpinned): в Windows файл,
+        отображенный в память, заменить нельзя.
+        """
+        if self._pins:
+            raise RuntimeError("Снапшот читается из потока, замена файла невозможна")
+        self.close()
+        os.replace(new_file, db_file)
+        with open(db_file, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        self._spans = {}
+        self._cache.clear()
+        for key, (offset, length, meta) in index['records'].items():
+            if key not in self._meta:
+                continue
+            self._spans[key] = (offset, length)
+            if self._changed_at.get(key, 0) <= snapshot_seq:
+                self._records.pop(key, None)
+                self._changed_at.pop(key, None)
+        
+        for key in [k for k, seq in self._changed_at.items() if seq <= snapshot_seq]:
+            del self._changed_at[key]
+    
+    def close(self):
+        """Закрыть отображение снапшота в память (закрепленное закроется после чтения)"""
+        if self._mm is not None:
+            if self._pins:
+                self._retired.append(self._mm)
+            else:
+                self._mm.close()
+            self._mm = None
+
+class ScamDatabase:
+    """База скамеров: снапшот в JSON + журнал изменений (append-only).
+
+    Каждое изменение дописывает в журнал одну строку с полной записью,
+    поэтому стоимость записи не зависит от размера базы. При старте журнал
+    проигрывается поверх снапшота, а периодическое сжатие переносит его
+    содержимое в снапшот.
+
+    Рядом со снапшотом хранится индекс (.idx) со смещениями записей, поэтому
+    при старте читаются только ключи и мета-информация, а сами записи
+    декодируются из файла по требованию (см. RecordStore).
+    """
+    def __init__(self, db_file: str = DB_FILE, journal_file: str = None,
+                 write_behind: Optional[Dict] = None):
+        self.db_file = db_file
+        self.journal_file = journal_file or os.path.splitext(db_file)[0] + '.journal'
+        self.index_file = os.path.splitext(db_file)[0] + '.idx'
+        self.journal_records = 0
+        self._snapshot_indexed = False
+        self._compacting = False
+        self._dirty_keys: Dict[str, None] = {}  # ключи, ждущие записи в журнал (по порядку)
+        self._writer = WriteBehind.from_settings(self._flush_journal, write_behind or {'enabled': False})
+        self._username_index: Dict[str, List[str]] = {}  # username -> ключи активных записей
+        self._username_sorted: List[str] = []  # имена из _username_index по алфавиту (поиск по префиксу)
+        self._fuzzy_index = FuzzyIndex()  # похожие username активных записей
+        self._stats = {'total_scammers': 0, 'total_reports': 0, 'removed_scammers': 0}
+        self._date_index: Dict[str, List[Tuple[str, str]]] = {}  # статус -> [(added_date, ключ)] по возрастанию
+        self._status_index: Dict[str, set] = {}  # статус -> ключи
+        self._country_index: Dict[str, set] = {}  # код страны -> ключи
+        self._rebuilding = False
+        # Сигнатура снапшота, каким его прочитал или записал сам бот
+        self._snapshot_signature = file_signature(db_file)
+        self.db = self.load_db()
+        self.replay_journal()
+        self._rebuild_indexes()
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+    
+    def load_db(self) -> RecordStore:
+        """Загрузка базы данных из файла"""
+        index = self._load_index()
+        if index is not None:
+            try:
+                store = RecordStore.open_snapshot(self.db_file, index)
+                self._snapshot_indexed = True
+                return store
+            except Exception as e:
+                logger.error(f"Ошибка открытия индекса базы, читаю снапшот целиком: {e}")
+        
+        if os.path.exists(self.db_file):
+            try:
+                return self._index_snapshot()
+            except Exception as e:
+                logger.error(f"Ошибка загрузки базы: {e}")
+                return RecordStore()
+        return RecordStore()
+    
+    def _index_snapshot(self) -> RecordStore:
+        """Построить индекс снапшота за один проход по файлу.
+        
+        Снапшот без индекса (старого формата или измененный вручную)
+        индексируется как есть, без перезаписи файла; в памяти держится
+        только мета-информация, дальше записи декодируются лениво.
+        """
+        index = self._scan_snapshot()
+        self._snapshot_signature = file_signature(self.db_file)
+        self._write_index(index)
+        self._snapshot_indexed = True
+        logger.info(f"Построен индекс базы: {len(index['records'])} записей")
+        return RecordStore.open_snapshot(self.db_file, index)
+    
+    def _scan_snapshot(self) -> Dict:
+        """Индекс снапшота в любом форматировании: смещения записей в файле как есть.
+        
+        Безопасно вызывать из потока.
+        """
+        records_index = {}
+        with open(self.db_file, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for key, start, end in iter_json_object_spans(mm):
+                info = json.loads(mm[start:end])
+                records_index[str(key)] = (start, end - start, RecordStore.make_meta(info))
+        return {'records': records_index}
+    
+    def _load_index(self) -> Optional[Dict]:
+        """Загрузить индекс снапшота, если он соответствует файлу базы"""
+        if not os.path.exists(self.index_file) or not os.path.exists(self.db_file):
+            return None
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            stat = os.stat(self.db_file)
+            if (index.get('snapshot_size') != stat.st_size
+                    or index.get('snapshot_mtime_ns') != stat.st_mtime_ns):
+                logger.info("Индекс базы устарел, снапшот будет прочитан целиком")
+                return None
+            return index
+        except Exception as e:
+            logger.error(f"Ошибка загрузки индекса базы: {e}")
+            return None
+    
+    def _write_index(self, index: Dict):
+        """Атомарно записать индекс для текущего файла снапшота"""
+        stat = os.stat(self.db_file)
+        index['snapshot_size'] = stat.st_size
+        index['snapshot_mtime_ns'] = stat.st_mtime_ns
+        tmp_file = self.index_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_file, self.index_file)
+    
+    def _iter_journal(self, start: int = 0, end: Optional[int] = None):
+        """Записи журнала между байтовыми позициями start и end"""
+        if not os.path.exists(self.journal_file):
+            return
+        
+        with open(self.journal_file, 'rb') as f:
+            f.seek(start)
+            line_no = 0
+            while end is None or f.tell() < end:
+                line = f.readline()
+                if not line:
+                    break
+                line_no += 1
+                if not line.strip():
+                    continue
                 try:
-                    user = await self.client.get_entity(clean_identifier)
-                    if isinstance(user, User):
-                        return self._format_user_info(user)
-                except Exception as e2:
-                    logger.debug(f"Не удалось получить по clean_identifier {clean_identifier}: {e2}")
+                    yield json.loads(line)
+                except ValueError:
+                    # Недописанная строка после аварийного завершения
+                    logger.warning(f"Пропущена повреждённая строка журнала #{line_no}")
+    
+    @staticmethod
+    def _apply_journal_entry(records, entry: Dict) -> bool:
+        """Применить запись журнала к словарю записей (или RecordStore)"""
+        if entry.get('op') == 'set':
+            records[entry['id']] = entry['data']
+        elif entry.get('op') == 'del':
+            records.pop(entry['id'], None)
+        else:
+            return False
+        return True
+    
+    def replay_journal(self):
+        """Проиграть журнал изменений поверх загруженного снапшота"""
+        applied = 0
+        for entry in self._iter_journal():
+            if self._apply_journal_entry(self.db, entry):
+                applied += 1
+        
+        self.journal_records = applied
+        if applied:
+            logger.info(f"Из журнала восстановлено изменений: {applied}")
+    
+    @staticmethod
+    def _record_usernames(user_id: str, meta: Dict) -> set:
+        """Нормализованные имена, по которым должна находиться запись"""
+        names = {normalize_username(meta.get('username')), normalize_username(user_id)}
+        names.discard('')
+        return names
+    
+    def _count_record(self, meta: Dict, sign: int):
+        """Учесть запись в счетчиках статистики (sign = 1 или -1)"""
+        status = meta.get('status')
+        if status == 'active':
+            self._stats['total_scammers'] += sign
+            self._stats['total_reports'] += sign * (meta.get('reports') or 0)
+        elif status == 'removed':
+            self._stats['removed_scammers'] += sign
+    
+    def _index_record(self, user_id: str):
+        """Добавить запись в индексы и счетчики"""
+        meta = self.db.meta(user_id)
+        if not meta:
+            return
+        self._count_record(meta, 1)
+        
+        date_entry = (meta.get('added_date') or '', user_id)
+        date_keys = self._date_index.setdefault(meta.get('status'), [])
+        if self._rebuilding:
+            date_keys.append(date_entry)
+        else:
+            bisect.insort(date_keys, date_entry)
+        
+        self._status_index.setdefault(meta.get('status'), set()).add(user_id)
+        country = normalize_country(meta.get('country'))
+        if country:
+            self._country_index.setdefault(country, set()).add(user_id)
+        
+        if meta.get('status') != 'active':
+            return
+        self._fuzzy_index.add(meta.get('username'), user_id)
+        for name in self._record_usernames(user_id, meta):
+            keys = self._username_index.get(name)
+            if keys is None:
+                keys = self._username_index[name] = []
+                if not self._rebuilding:
+                    bisect.insort(self._username_sorted, name)
+            if user_id not in keys:
+                keys.append(user_id)
+    
+    def _unindex_record(self, user_id: str):
+        """Убрать запись из индексов и счетчиков (вызывать до сохранения изменённой записи)"""
+        meta = self.db.meta(user_id)
+        if not meta:
+            return
+        self._count_record(meta, -1)
+        
+        date_entry = (meta.get('added_date') or '', user_id)
+        date_keys = self._date_index.get(meta.get('status'), [])
+        pos = bisect.bisect_left(date_keys, date_entry)
+        if pos < len(date_keys) and date_keys[pos] == date_entry:
+            del date_keys[pos]
+        
+        self._status_index.get(meta.get('status'), set()).discard(user_id)
+        country = normalize_country(meta.get('country'))
+        if country in self._country_index:
+            self._country_index[country].discard(user_id)
+            if not self._country_index[country]:
+                del self._country_index[country]
+        
+        self._fuzzy_index.remove(meta.get('username'), user_id)
+        for name in self._record_usernames(user_id, meta):
+            keys = self._username_index.get(name)
+            if keys and user_id in keys:
+                keys.remove(user_id)
+                if not keys:
+                    del self._username_index[name]
+                    pos = bisect.bisect_left(self._username_sorted, name)
+                    if pos < len(self._username_sorted) and self._username_sorted[pos] == name:
+                        del self._username_sorted[pos]
+    
+    def _rebuild_indexes(self):
+        """Построить индексы заново по всей базе"""
+        self._username_index = {}
+        self._fuzzy_index = FuzzyIndex()
+        self._stats = {'total_scammers': 0, 'total_reports': 0, 'removed_scammers': 0}
+        self._date_index = {}
+        self._status_index = {}
+        self._country_index = {}
+        self._rebuilding = True
+        try:
+            for user_id in self.db:
+                self._index_record(user_id)
+        finally:
+            self._rebuilding = False
+        for date_keys in self._date_index.values():
+            date_keys.sort()
+        self._username_sorted = sorted(self._username_index)
+    
+    def _log_change(self, user_id: str):
+        """Отметить запись как изменённую; в журнал она попадёт при сбросе"""
+        self._dirty_keys.pop(user_id, None)
+        self._dirty_keys[user_id] = None
+        self._writer.mark_dirty()
+    
+    def _flush_journal(self):
+        """Дописать в журнал текущее состояние всех изменённых записей"""
+        dirty_keys, self._dirty_keys = self._dirty_keys, {}
+        lines = []
+        for user_id in dirty_keys:
+            if user_id in self.db:
+                entry = {'op': 'set', 'id': user_id, 'data': self.db[user_id]}
+            else:
+                entry = {'op': 'del', 'id': user_id}
+            lines.append(json.dumps(entry, ensure_ascii=False) + '\n')
+        
+        try:
+            self._journal.write(''.join(lines))
+            self._journal.flush()
+            self.journal_records += len(lines)
+        except Exception as e:
+            logger.error(f"Ошибка записи в журнал: {e}")
+            # Не записанные ключи вернутся в журнал при следующем сбросе
+            dirty_keys.update(self._dirty_keys)
+            self._dirty_keys = dirty_keys
+    
+    def flush(self) -> bool:
+        """Записать все отложенные изменения в журнал (False - запись не удалась)"""
+        self._writer.flush()
+        if self._dirty_keys:
+            # Остались ключи после неудачной записи, а счетчик WriteBehind уже сброшен
+            self._flush_journal()
+        return not self._dirty_keys
+    
+    def _truncate_journal(self, offset: int):
+        """Оставить в журнале только записи, сделанные после позиции offset"""
+        self._journal.close()
+        with open(self.journal_file, 'rb') as f:
+            f.seek(offset)
+            tail = f.read()
+        
+        tmp_file = self.journal_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(tail)
+        os.replace(tmp_file, self.journal_file)
+        
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self.journal_records = tail.count(b'\n')
+    
+    def save_db(self) -> bool:
+        """Сохранение базы данных в файл (полный снапшот + очистка журнала).
+        
+        Синхронный вариант для остановки бота; из обработчиков используйте compact().
+        """
+        if self._compacting:
+            logger.warning("Сохранение базы пропущено: уже идет сжатие или перезагрузка")
+            return False
+        try:
+            self.flush()
+            self._journal.flush()
+            offset = self._journal.tell()
+            seq, entries = self.db.snapshot_entries()
+            tmp_file = self.db_file + '.tmp'
+            index = self.db.write_snapshot(tmp_file, entries)
+            self.db.swap_snapshot(self.db_file, tmp_file, index, seq)
+            self._snapshot_signature = file_signature(self.db_file)
+            self._write_index(index)
+            self._snapshot_indexed = True
+            self._truncate_journal(offset)
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения базы: {e}")
+            return False
+    
+    def needs_compaction(self) -> bool:
+        """Пора ли переносить журнал в снапшот (или строить индекс снапшота)"""
+        return self.journal_records >= JOURNAL_COMPACT_THRESHOLD or not self._snapshot_indexed
+    
+    async def compact(self, wait: bool = False) -> bool:
+        """Перенести журнал в снапшот, не блокируя event loop.
+        
+        Записи журнала идемпотентны (полное состояние записи), поэтому
+        изменения, попавшие и в снапшот, и в остаток журнала, безопасны.
+        Если сжатие уже идет, при wait=True дожидаемся его и сжимаем заново
+        (чтобы попали изменения, сделанные после его начала), иначе выходим.
+        Возвращает True, если снапшот записан.
+        """
+        if self._compacting and not wait:
+            return False
+        while self._compacting:
+            await asyncio.sleep(0.05)
+        
+        self._compacting = True
+        try:
+            self.flush()
+            self._journal.flush()
+            offset = self._journal.tell()
+            tmp_file = self.db_file + '.tmp'
+            with self.db.pinned_snapshot() as (seq, entries, mm):
+                index = await asyncio.to_thread(self.db.write_snapshot, tmp_file, entries, mm)
+            # Старый снапшот еще могут читать выгрузки; заменить его можно только после них
+            await self.db.wait_unpinned()
+            self.db.swap_snapshot(self.db_file, tmp_file, index, seq)
+            self._snapshot_signature = file_signature(self.db_file)
+            await asyncio.to_thread(self._write_index, index)
+            self._snapshot_indexed = True
+            self._truncate_journal(offset)
+            logger.info(f"База сжата: {len(entries)} записей в снапшоте")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сжатия журнала базы: {e}")
+            return False
+        finally:
+            self._compacting = False
+    
+    async def reload_if_changed(self) -> bool:
+        """Подхватить снапшот, измененный в обход бота (восстановление из бэкапа, ручная правка).
+        
+        Собственные записи узнаются по сигнатуре файла. Новый снапшот
+        индексируется потоковым проходом, как при запуске, и открывается
+        лениво. Изменения из журнала сохраняются для записей, которые
+        внешняя правка не тронула (запись в новом файле та же, что в
+        прежнем снапшоте); для остальных главнее внешний файл. Изменения,
+        внесенные ботом во время чтения файла, применяются всегда. Индексы
+        обновляются только для записей с изменившейся мета-информацией.
+        """
+        signature = file_signature(self.db_file)
+        if signature is None or signature == self._snapshot_signature or self._compacting:
+            return False
+        
+        # Флаг общий со сжатием: оба заменяют снапшот
+        self._compacting = True
+        try:
+            self.flush()
+            self._journal.flush()
+            offset = self._journal.tell()
+            index = await asyncio.to_thread(self._scan_snapshot)
             
-            return None
+            if file_signature(self.db_file) != signature:
+                # Файл еще дописывают снаружи, перечитаем при следующей проверке
+                return False
             
+            # Старый снапшот еще могут читать выгрузки; закрыть его можно только после них
+            await self.db.wait_unpinned()
+            # Изменения, сделанные пока читался файл, уже есть в журнале после offset
+            self.flush()
+            self._journal.flush()
+            tail = list(self._iter_journal(offset))
+            # Последнее состояние каждой записи из журнала до перечитывания
+            # и ее вид в прежнем снапшоте - чтобы узнать, тронул ли ее внешний файл
+            head = {entry['id']: entry for entry in self._iter_journal(0, offset) if 'id' in entry}
+            old_records = {}
+            for key in head:
+                try:
+                    old_records[key] = self.db.snapshot_record(key)
+                except ValueError:
+                    # Файл переписан на месте, прежний вид записи не прочитать
+                    continue
+            
+            new_records = index['records']
+            changed = {key for key in self.db if key not in new_records}
+            changed.update(key for key, (_, _, meta) in new_records.items()
+                           if self.db.meta(key) != meta)
+            changed.update(head)
+            changed.update(entry['id'] for entry in tail if 'id' in entry)
+            
+            for key in changed:
+                self._unindex_record(key)
+            self.db.close()
+            self.db = RecordStore.open_snapshot(self.db_file, index)
+            kept = [key for key in head
+                    if key in old_records and self.db.snapshot_record(key) == old_records[key]]
+            for key in kept:
+                self._apply_journal_entry(self.db, head[key])
+            for entry in tail:
+                self._apply_journal_entry(self.db, entry)
+            for key in changed:
+                self._index_record(key)
+            
+            self._snapshot_signature = file_signature(self.db_file)
+            await asyncio.to_thread(self._write_index, index)
+            self._snapshot_indexed = True
+            self._truncate_journal(offset)
+            # Сохраненные изменения есть только в памяти: возвращаем их в журнал
+            for key in kept:
+                self._log_change(key)
+            self.flush()
+            if len(kept) < len(head):
+                logger.warning(f"Снапшот базы заменен снаружи, внешней правкой перекрыто "
+                               f"изменений журнала: {len(head) - len(kept)}")
+            logger.info(f"База перечитана с диска, изменено записей: {len(changed)}, "
+                        f"сохранено изменений журнала: {len(kept)}")
+            return True
         except Exception as e:
-            logger.error(f"Ошибка в get_user_info для {identifier}: {e}")
-            return None
+            logger.error(f"Ошибка перечитывания базы, оставлено прежнее состояние: {e}")
+            # Битый файл не перечитываем, пока его снова не изменят
+            self._snapshot_signature = signature
+            return False
+        finally:
+            self._compacting = False
+    
+    def close(self):
+        """Записать отложенные изменения и закрыть файлы базы"""
+        self.flush()
+        if not self._journal.closed:
+            self._journal.close()
+        self.db.close()
+    
+    def add_scammer(self, user_id: str, username: str, 
+                   reason: str, added_by: int, chat_id: int = None,
+                   country: str = None, proof_link: str = None) -> Tuple[bool, str, bool]:
+        """Добавление скамера в базу или обновление существующего"""
+        try:
+            if user_id.isdigit():
+                if config.is_admin(int(user_id)):
+                    return False, "Нельзя добавить администратора в базу скамеров", False
+            
+            self._unindex_record(user_id)
+            if self.db.meta(user_id).get('status') == 'active':
+                user_data = self.db[user_id]
+                merge_scammer_report(user_data, username, reason, proof_link)
+                self.db[user_id] = user_data
+                self._index_record(user_id)
+                self._log_change(user_id)
+                return True, "Обновлена запись в базе", False
+            
+            self.db[user_id] = make_scammer_record(user_id, username, reason, added_by,
+                                                   chat_id, country, proof_link)
+            self._index_record(user_id)
+            self._log_change(user_id)
+            return True, "Успешно добавлен", True
+            
+        except Exception as e:
+            logger.error(f"Ошибка добавления скамера: {e}")
+            logger.error(traceback.format_exc())
+            return False, f"Ошибка добавления: {str(e)}", False
+    
+    def import_records(self, entries: List[Dict], added_by: int) -> Counter:
+        """Слить пачку записей импорта (см. merge_imported_entry).
+        
+        Вся пачка считается одним изменением для отложенной записи в журнал;
+        после импорта нужно вызвать compact(wait=True), который перенесет
+        ее в снапшот.
+        """
+        result = Counter()
+        for entry in entries:
+            user_id = entry['user_id']
+            if user_id.isdigit() and config.is_admin(int(user_id)):
+                result['skipped'] += 1
+                continue
+            
+            self._unindex_record(user_id)
+            user_data = self.db[user_id] if user_id in self.db else None
+            user_data, is_new = merge_imported_entry(user_data, entry, added_by)
+            self.db[user_id] = user_data
+            self._index_record(user_id)
+            self._dirty_keys.pop(user_id, None)
+            self._dirty_keys[user_id] = None
+            result['added' if is_new else 'updated'] += 1
+        if entries:
+            self._writer.mark_dirty()
+        return result
+    
+    def check_user(self, user_id: str) -> Optional[Dict]:
+        """Проверка пользователя в базе"""
+        if self.db.meta(user_id).get('status') == 'active':
+            return self.db[user_id]
+        return None
+    
+    def find_scammer_by_username(self, username: str) -> Optional[Dict]:
+        """Поиск скамера по username (с @ или без)"""
+        keys = self._username_index.get(normalize_username(username))
+        if keys:
+            return self.db[keys[0]]
+        return None
+    
+    def find_by_prefix(self, prefix: str, limit: int = 20) -> List[Dict]:
+        """Активные скамеры, у которых username или ID начинается с prefix.
+        
+        Бинарный поиск по отсортированному списку имен, без обхода базы.
+        """
+        prefix = normalize_username(prefix)
+        if not prefix:
+            return []
+        
+        results = []
+        seen = set()
+        pos = bisect.bisect_left(self._username_sorted, prefix)
+        while pos < len(self._username_sorted) and len(results) < limit:
+            name = self._username_sorted[pos]
+            if not name.startswith(prefix):
+                break
+            for key in self._username_index.get(name, []):
+                if key not in seen:
+                    seen.add(key)
+                    results.append(self.db[key])
+            pos += 1
+        return results[:limit]
+    
+    def find_similar(self, username: str, limit: int = FUZZY_SUGGESTIONS) -> List[Tuple[Dict, int]]:
+        """Активные скамеры с похожим username: [(запись, расстояние)], без точных совпадений"""
+        exact = set(self._username_index.get(normalize_username(username), []))
+        return [(self.db[key], distance)
+                for key, distance in self._fuzzy_index.search(username, limit, exact)]
+    
+    def remove_scammer(self, user_id: str) -> bool:
+        """Удаление скамера из базы"""
+        if user_id in self.db:
+            self._unindex_record(user_id)
+            user_data = self.db[user_id]
+            user_data['status'] = 'removed'
+            user_data['removed_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.db[user_id] = user_data
+            self._index_record(user_id)
+            self._log_change(user_id)
+            return True
+        return False
+    
+    def permanently_delete_scammer(self, user_id: str) -> bool:
+        """Полное удаление скамера из базы"""
+        if user_id in self.db:
+            self._unindex_record(user_id)
+            del self.db[user_id]
+            self._log_change(user_id)
+            return True
+        return False
+    
+    def increment_reports(self, user_id: str):
+        """Увеличение счетчика жалоб"""
+        if user_id in self.db:
+            self._unindex_record(user_id)
+            user_data = self.db[user_id]
+            user_data['reports'] = user_data.get('reports', 0) + 1
+            self.db[user_id] = user_data
+            self._index_record(user_id)
+            self._log_change(user_id)
+    
+    def set_country(self, user_id: str, country: str):
+        """Установка страны для скамера"""
+        if user_id in self.db:
+            self._unindex_record(user_id)
+            user_data = self.db[user_id]
+            user_data['country'] = normalize_country(country)
+            self.db[user_id] = user_data
+            self._index_record(user_id)
+            self._log_change(user_id)
     
-    def _format_user_info(self, user: User) -> Dict:
-        """Форматировать информацию о пользователе"""
-        username = user.username or ""
-        
-        if not username:
-            if user.first_name:
-                username = user.first_name
-                if user.last_name:
-                    username += f" {user.last_name}"
-            else:
-                username = f"id{user.id}"
+    def cache_stats(self) -> Optional[Dict]:
+        """Статистика кэша записей: {'size', 'hits', 'misses'} (см. RecordStore.cache_stats)"""
+        return self.db.cache_stats()
+    
+    def get_stats(self) -> Dict:
+        """Получение статистики (по счетчикам, без обхода базы)"""
+        stats = dict(self._stats)
+        stats['total_in_db'] = len(self.db)
+        return stats
+    
+    def verify_stats(self) -> Dict:
+        """Пересчитать статистику с нуля и исправить расхождения.
         
-        return {
-            'id': user.id,
-            'username': username,
-            'first_name': user.first_name or "",
-            'last_name': user.last_name or "",
-            'phone': user.phone or "",
-            'bot': user.bot,
-            'premium': getattr(user, 'premium', False),
-            'scam': getattr(user, 'scam', False),
-            'fake': getattr(user, 'fake', False),
-            'verified': getattr(user, 'verified', False)
+        Возвращает {счетчик: (было, стало)} для счетчиков, которые разошлись.
+        """
+        active_scammers = [m for m in self.db.iter_meta() if m.get('status') == 'active']
+        actual = {
+            'total_scammers': len(active_scammers),
+            'total_reports': sum(meta.get('reports') or 0 for meta in active_scammers),
+            'removed_scammers': len([m for m in self.db.iter_meta() if m.get('status') == 'removed'])
         }
+        
+        drift = {name: (self._stats[name], value) for name, value in actual.items()
+                 if self._stats[name] != value}
+        if drift:
+            logger.warning(f"Расхождение счетчиков статистики: {drift}")
+            self._stats = actual
+        return drift
     
-    async def close(self):
-        """Закрыть соединение"""
-        if self.client and self.is_connected:
-            await self.client.disconnect()
-            self.is_connected = False
-            print("🔌 Telegram User API отключен")
+    def search_by_country(self, country: str) -> List[Dict]:
+        """Поиск скамеров по стране"""
+        return self.search(country=country)
+    
+    def search(self, country: str = None, status: Optional[str] = 'active',
+               date_from: str = None, date_to: str = None,
+               min_reports: int = None, max_reports: int = None,
+               limit: int = None) -> List[Dict]:
+        """Поиск по стране, статусу, периоду добавления и числу жалоб.
+        
+        Кандидаты получаются пересечением списков из индексов (страна,
+        статус, диапазон дат); число жалоб проверяется по мета-информации.
+        Даты - строки 'YYYY-MM-DD' (включительно). status=None - любой статус.
+        Результат отсортирован от новых записей к старым.
+        """
+        postings = []
+        
+        if country:
+            postings.append(self._country_index.get(normalize_country(country), set()))
+        
+        statuses = [status] if status else list(self._date_index)
+        if date_from or date_to:
+            low = (date_from or '',)
+            high = ((date_to or '9999-99-99') + '\uffff',)
+            in_range = set()
+            for record_status in statuses:
+                date_keys = self._date_index.get(record_status, [])
+                start = bisect.bisect_left(date_keys, low)
+                end = bisect.bisect_right(date_keys, high)
+                in_range.update(user_id for _, user_id in date_keys[start:end])
+            postings.append(in_range)
+        elif status:
+            postings.append(self._status_index.get(status, set()))
+        
+        if postings:
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates &= posting
+        else:
+            candidates = set(self.db)
+        
+        if min_reports is not None or max_reports is not None:
+            candidates = {
+                user_id for user_id in candidates
+                if (min_reports is None or (self.db.meta(user_id).get('reports') or 0) >= min_reports)
+                and (max_reports is None or (self.db.meta(user_id).get('reports') or 0) <= max_reports)
+            }
+        
+        ordered = sorted(candidates,
+                         key=lambda user_id: (self.db.meta(user_id).get('added_date') or '', user_id),
+                         reverse=True)
+        if limit is not None:
+            ordered = ordered[:limit]
+        return [self.db[user_id] for user_id in ordered]
+    
+    async def export(self, path: str, fmt: str = 'ndjson', **filters) -> int:
+        """Выгрузить записи в сжатый файл, не блокируя event loop.
+        
+        Состояние фиксируется в момент вызова: записи читаются из закрепленного
+        снапшота и копий измененных записей, так что параллельные изменения
+        в выгрузку не попадают. filters - условия как у search().
+        """
+        matches = make_meta_filter(**filters)
+        with self.db.pinned_snapshot() as (_, entries, mm):
+            records = (RecordStore.read_entry(source, mm)
+                       for _, source, meta in entries if matches(meta))
+            return await asyncio.to_thread(write_export_file, path, fmt, records)
+    
+    def get_recent_scammers(self, limit: int = 10) -> List[Dict]:
+        """Получение последних добавленных скамеров"""
+        return self.get_recent_page(limit=limit)[0]
+    
+    def get_recent_page(self, cursor: Optional[str] = None, limit: int = 10) -> Tuple[List[Dict], Optional[str]]:
+        """Страница активных скамеров от новых к старым.
+        
+        cursor - значение, полученное с предыдущей страницы (None - первая страница).
+        Возвращает (записи, курсор следующей страницы или None).
+        """
+        date_keys = self._date_index.get('active', [])
+        end = len(date_keys)
+        if cursor:
+            end = bisect.bisect_left(date_keys, parse_recent_cursor(cursor))
+        
+        start = max(0, end - limit)
+        page = date_keys[start:end][::-1]
+        next_cursor = make_recent_cursor(*page[-1]) if page and start > 0 else None
+        return [self.db[user_id] for _, user_id in page], next_cursor
 
-class ScamDatabase:
-    def __init__(self, db_file: str = DB_FILE):
-        self.db_file = db_file
-        self.db = self.load_db()
+class SQLiteScamDatabase:
+    """База скамеров в SQLite (режим WAL) с тем же API, что и ScamDatabase.
+
+    Записи не держатся в памяти целиком: каждый запрос идёт по индексам,
+    а полная запись хранится в колонке data в виде JSON.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS scammers (
+            key TEXT PRIMARY KEY,
+            user_id TEXT,
+            username TEXT,
+            username_norm TEXT,
+            country TEXT,
+            status TEXT,
+            added_date TEXT,
+            reports INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL,
+            key_norm TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_scammers_user_id ON scammers(user_id);
+        CREATE INDEX IF NOT EXISTS idx_scammers_username ON scammers(username_norm);
+        CREATE INDEX IF NOT EXISTS idx_scammers_country ON scammers(country COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS idx_scammers_status ON scammers(status);
+        CREATE INDEX IF NOT EXISTS idx_scammers_added_date ON scammers(added_date);
+        CREATE INDEX IF NOT EXISTS idx_scammers_status_added ON scammers(status, added_date, key);
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TRIGGER IF NOT EXISTS scammers_stats_insert AFTER INSERT ON scammers BEGIN
+            UPDATE stats SET value = value + (NEW.status = 'active') WHERE name = 'total_scammers';
+            UPDATE stats SET value = value + (NEW.status = 'active') * NEW.reports WHERE name = 'total_reports';
+            UPDATE stats SET value = value + (NEW.status = 'removed') WHERE name = 'removed_scammers';
+            UPDATE stats SET value = value + 1 WHERE name = 'total_in_db';
+        END;
+        CREATE TRIGGER IF NOT EXISTS scammers_stats_delete AFTER DELETE ON scammers BEGIN
+            UPDATE stats SET value = value - (OLD.status = 'active') WHERE name = 'total_scammers';
+            UPDATE stats SET value = value - (OLD.status = 'active') * OLD.reports WHERE name = 'total_reports';
+            UPDATE stats SET value = value - (OLD.status = 'removed') WHERE name = 'removed_scammers';
+            UPDATE stats SET value = value - 1 WHERE name = 'total_in_db';
+        END;
+        CREATE TRIGGER IF NOT EXISTS scammers_stats_update AFTER UPDATE ON scammers BEGIN
+            UPDATE stats SET value = value - (OLD.status = 'active') + (NEW.status = 'active')
+                WHERE name = 'total_scammers';
+            UPDATE stats SET value = value - (OLD.status = 'active') * OLD.reports
+                                           + (NEW.status = 'active') * NEW.reports
+                WHERE name = 'total_reports';
+            UPDATE stats SET value = value - (OLD.status = 'removed') + (NEW.status = 'removed')
+                WHERE name = 'removed_scammers';
+        END;
+    """
+    STATS_NAMES = ('total_scammers', 'total_reports', 'removed_scammers', 'total_in_db')
+    # Журнал изменений для общего режима: по нему воркеры сбрасывают свои кэши.
+    # Для записей хранится прежнее имя и статус, чтобы поправить индекс похожих имен
+    SHARED_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            key TEXT NOT NULL,
+            old_username TEXT,
+            old_status TEXT
+        );
+        CREATE TRIGGER IF NOT EXISTS scammers_changes_insert AFTER INSERT ON scammers BEGIN
+            INSERT INTO changes (tbl, key) VALUES ('scammers', NEW.key);
+        END;
+        CREATE TRIGGER IF NOT EXISTS scammers_changes_update AFTER UPDATE ON scammers BEGIN
+            INSERT INTO changes (tbl, key, old_username, old_status)
+                VALUES ('scammers', OLD.key, OLD.username, OLD.status);
+        END;
+        CREATE TRIGGER IF NOT EXISTS scammers_changes_delete AFTER DELETE ON scammers BEGIN
+            INSERT INTO changes (tbl, key, old_username, old_status)
+                VALUES ('scammers', OLD.key, OLD.username, OLD.status);
+        END;
+        CREATE TRIGGER IF NOT EXISTS settings_changes_insert AFTER INSERT ON settings
+            WHEN NEW.key LIKE 'config.%' BEGIN
+            INSERT INTO changes (tbl, key) VALUES ('settings', NEW.key);
+        END;
+        CREATE TRIGGER IF NOT EXISTS settings_changes_update AFTER UPDATE ON settings
+            WHEN NEW.key LIKE 'config.%' BEGIN
+            INSERT INTO changes (tbl, key) VALUES ('settings', NEW.key);
+        END;
+    """
     
-    def load_db(self) -> Dict:
-        """Загрузка базы данных из файла"""
-        if os.path.exists(self.db_file):
+    def __init__(self, sqlite_file: str = SQLITE_DB_FILE, json_file: str = DB_FILE, shared: bool = False):
+        self.sqlite_file = sqlite_file
+        self.shared = shared
+        self._fuzzy_index: Optional[FuzzyIndex] = None  # строится при первом поиске похожих
+        # Кэш чтения записей воркера (только в общем режиме)
+        self._cache = TTLCache(SHARED_CACHE_SIZE, SHARED_CACHE_TTL) if shared else None
+        self.changes_applied = 0
+        self.conn = sqlite3.connect(sqlite_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._add_key_norm()
+        if shared:
+            self.conn.executescript(self.SHARED_SCHEMA)
+        if self.conn.execute("SELECT COUNT(*) FROM stats").fetchone()[0] < len(self.STATS_NAMES):
+            self.verify_stats()
+        
+        if json_file and not self._get_setting('migrated_from_json'):
+            self.migrate_from_json(json_file)
+        if not self._get_setting('country_codes'):
+            self._normalize_countries()
+        # Меняется, только когда изменения фиксирует другое соединение
+        self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self._changes_seq = self.conn.execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM changes"
+        ).fetchone()[0] if shared else 0
+    
+    def _add_key_norm(self):
+        """Колонка key_norm - ключ в виде normalize_username для поиска по ключу
+        без учета регистра, как в JSON-базе (для баз, созданных раньше, заполняется здесь)
+        """
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(scammers)")}
+        if 'key_norm' not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE scammers ADD COLUMN key_norm TEXT")
+                keys = [row[0] for row in self.conn.execute("SELECT key FROM scammers")]
+                self.conn.executemany("UPDATE scammers SET key_norm = ? WHERE key = ?",
+                                      [(normalize_username(key), key) for key in keys])
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_scammers_key_norm ON scammers(key_norm)")
+    
+    def _normalize_countries(self):
+        """Перевести колонку country в коды стран (для баз, созданных раньше)"""
+        with self.conn:
+            rows = self.conn.execute("SELECT key, country FROM scammers WHERE country IS NOT NULL").fetchall()
+            self.conn.executemany("UPDATE scammers SET country = ? WHERE key = ?",
+                                  [(normalize_country(country), key) for key, country in rows])
+            self._set_setting('country_codes', '1')
+    
+    def _get_setting(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def _set_setting(self, key: str, value: str):
+        self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
+    
+    def load_shared_config(self, names: Optional[set] = None) -> Dict[str, str]:
+        """Настройки конфига из общей базы: {имя: JSON} (все или только names)"""
+        rows = self.conn.execute("SELECT key, value FROM settings WHERE key LIKE 'config.%'")
+        values = {key[len('config.'):]: value for key, value in rows}
+        if names is not None:
+            values = {key: value for key, value in values.items() if key in names}
+        return values
+    
+    def save_shared_config(self, values: Dict[str, str]):
+        """Записать изменившиеся настройки конфига в общую базу"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [('config.' + key, value) for key, value in values.items()]
+            )
+    
+    @contextlib.contextmanager
+    def _write_transaction(self):
+        """Транзакция чтение-изменение-запись.
+        
+        В общем режиме блокировка записи берется сразу (BEGIN IMMEDIATE),
+        чтобы другой воркер не изменил запись между чтением и записью.
+        """
+        if self.shared and not self.conn.in_transaction:
+            self.conn.execute("BEGIN IMMEDIATE")
+        with self.conn:
+            yield
+    
+    def _row_values(self, key: str, info: Dict) -> Tuple:
+        return (
+            key,
+            normalize_username(key),
+            str(info.get('user_id', key)),
+            info.get('username'),
+            normalize_username(info.get('username')),
+            normalize_country(info.get('country')),
+            info.get('status'),
+            info.get('added_date') or '',
+            info.get('reports') or 0,
+            json.dumps(info, ensure_ascii=False)
+        )
+    
+    def _put(self, key: str, info: Dict):
+        if self._cache is not None:
+            self._cache.invalidate(key)
+        if self._fuzzy_index is not None:
+            self._update_fuzzy_index(key, info)
+        # UPSERT, а не INSERT OR REPLACE: REPLACE не вызывает триггеры удаления,
+        # и счетчики в таблице stats разошлись бы
+        self.conn.execute(
+            "INSERT INTO scammers "
+            "(key, key_norm, user_id, username, username_norm, country, status, added_date, reports, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET user_id = excluded.user_id, "
+            "username = excluded.username, username_norm = excluded.username_norm, "
+            "country = excluded.country, status = excluded.status, "
+            "added_date = excluded.added_date, reports = excluded.reports, data = excluded.data",
+            self._row_values(key, info)
+        )
+    
+    def _get(self, key: str) -> Optional[Dict]:
+        # Внутри транзакции записи читаем только из базы: кэш может отставать
+        use_cache = self._cache is not None and not self.conn.in_transaction
+        if use_cache:
+            found, info = self._cache.get(key)
+            if found:
+                return info
+        
+        row = self.conn.execute("SELECT data FROM scammers WHERE key = ?", (key,)).fetchone()
+        info = json.loads(row[0]) if row else None
+        if use_cache:
+            self._cache.set(key, info)
+        return info
+    
+    def _query(self, sql: str, params: Tuple = ()) -> List[Dict]:
+        return [json.loads(row[0]) for row in self.conn.execute(sql, params)]
+    
+    def migrate_from_json(self, json_file: str):
+        """Однократный перенос записей из JSON-снапшота (вместе с журналом)"""
+        if os.path.exists(json_file):
+            source = ScamDatabase(json_file)
             try:
-                with open(self.db_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Ошибка загрузки базы: {e}")
-                return {}
-        return {}
+                with self.conn:
+                    for key, info in source.db.items():
+                        self._put(key, info)
+                    self._set_setting('migrated_from_json', json_file)
+                logger.info(f"В SQLite перенесено записей из {json_file}: {len(source.db)}")
+            finally:
+                source.close()
+        else:
+            with self.conn:
+                self._set_setting('migrated_from_json', '')
+    
+    def save_db(self) -> bool:
+        """Сохранение базы данных (в SQLite изменения фиксируются сразу)"""
+        self.conn.commit()
+        return True
+    
+    def flush(self) -> bool:
+        """Отложенных изменений у SQLite нет: каждая операция — транзакция"""
+        self.conn.commit()
+        return True
+    
+    def needs_compaction(self) -> bool:
+        """Перенос WAL в основной файл дешёвый, выполняем его по расписанию"""
+        return True
     
-    def save_db(self):
-        """Сохранение базы данных в файл"""
+    async def compact(self, wait: bool = False) -> bool:
+        """Перенести WAL в основной файл базы (и очистить старые уведомления об изменениях).
+        
+        Возвращает True, если изменения сохранены; wait — для совместимости с JSON-базой.
+        """
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(self.db, f, ensure_ascii=False, indent=2)
+            if self.shared:
+                with self.conn:
+                    self.conn.execute(
+                        "DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+                        (SHARED_CHANGES_KEEP,)
+                    )
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            return True
         except Exception as e:
-            logger.error(f"Ошибка сохранения базы: {e}")
+            logger.error(f"Ошибка checkpoint SQLite: {e}")
+            return False
+    
+    async def reload_if_changed(self) -> bool:
+        """Записи SQLite читаются из файла при каждом запросе; после записи
+        другим процессом сбрасываем только индекс похожих имен"""
+        if self.shared:
+            # Изменения других процессов точечно применяет poll_changes
+            return False
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return False
+        self._data_version = version
+        self._fuzzy_index = None
+        logger.info("База SQLite изменена другим процессом, индекс похожих имен будет перестроен")
+        return True
+    
+    def poll_changes(self) -> Optional[set]:
+        """Применить изменения, сделанные другими воркерами (общий режим).
+        
+        По таблице changes сбрасывает кэш измененных записей и правит индекс
+        похожих имен. Возвращает имена изменившихся настроек конфига; None,
+        если журнал изменений уже очищен дальше нашей позиции (тогда кэши
+        сброшены целиком и конфиг нужно перечитать полностью).
+        """
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return set()
+        self._data_version = version
+        
+        rows = self.conn.execute(
+            "SELECT seq, tbl, key, old_username, old_status FROM changes WHERE seq > ? ORDER BY seq",
+            (self._changes_seq,)
+        ).fetchall()
+        if not rows:
+            return set()
+        
+        if rows[0][0] > self._changes_seq + 1:
+            self._changes_seq = rows[-1][0]
+            self._cache.clear()
+            self._fuzzy_index = None
+            logger.warning("Пропущены уведомления об изменениях, кэш воркера сброшен целиком")
+            return None
+        
+        self._changes_seq = rows[-1][0]
+        self.changes_applied += len(rows)
+        config_names, keys = set(), set()
+        for _, table, key, old_username, old_status in rows:
+            if table == 'settings':
+                config_names.add(key[len('config.'):])
+                continue
+            keys.add(key)
+            self._cache.invalidate(key)
+            if self._fuzzy_index is not None and old_status == 'active':
+                self._fuzzy_index.remove(old_username, key)
+        
+        # Свои изменения тоже приходят сюда: удаление и добавление по текущему
+        # состоянию идемпотентны, поэтому повтор ничего не портит
+        if self._fuzzy_index is not None:
+            for key in keys:
+                row = self.conn.execute("SELECT username, status FROM scammers WHERE key = ?", (key,)).fetchone()
+                if row and row[1] == 'active':
+                    self._fuzzy_index.add(row[0], key)
+        return config_names
+    
+    def close(self):
+        """Закрыть соединение с базой"""
+        self.conn.close()
     
     def add_scammer(self, user_id: str, username: str, 
                    reason: str, added_by: int, chat_id: int = None,
@@ -391,49 +2700,15 @@ class ScamDatabase:
                 if config.is_admin(int(user_id)):
                     return False, "Нельзя добавить администратора в базу скамеров", False
             
-            is_new = False
-            if user_id in self.db:
-                user_data = self.db[user_id]
-                if user_data.get('status') == 'active':
-                    existing_reasons = user_data.get('reasons', [])
-                    if reason not in existing_reasons:
-                        existing_reasons.append(reason)
-                        user_data['reasons'] = existing_reasons
-                    
-                    user_data['reports'] = user_data.get('reports', 0) + 1
-                    
-                    if proof_link:
-                        proofs = user_data.get('proofs', [])
-                        if proof_link not in proofs:
-                            proofs.append(proof_link)
-                            user_data['proofs'] = proofs
-                    
-                    if username and username != user_data.get('username'):
-                        user_data['username'] = username
-                    
-                    self.db[user_id] = user_data
-                    self.save_db()
+            with self._write_transaction():
+                user_data = self._get(user_id)
+                if user_data and user_data.get('status') == 'active':
+                    merge_scammer_report(user_data, username, reason, proof_link)
+                    self._put(user_id, user_data)
                     return True, "Обновлена запись в базе", False
-                else:
-                    is_new = True
-            else:
-                is_new = True
-            
-            if is_new:
-                self.db[user_id] = {
-                    'username': username,
-                    'user_id': user_id,
-                    'reasons': [reason],
-                    'country': country,
-                    'scam_chance': 100,
-                    'proofs': [proof_link] if proof_link else [],
-                    'added_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                    'added_by': added_by,
-                    'added_from_chat': chat_id,
-                    'reports': 1,
-                    'status': 'active'
-                }
-                self.save_db()
+                
+                self._put(user_id, make_scammer_record(user_id, username, reason, added_by,
+                                                       chat_id, country, proof_link))
                 return True, "Успешно добавлен", True
             
         except Exception as e:
@@ -441,101 +2716,289 @@ class ScamDatabase:
             logger.error(traceback.format_exc())
             return False, f"Ошибка добавления: {str(e)}", False
     
+    def import_records(self, entries: List[Dict], added_by: int) -> Counter:
+        """Слить пачку записей импорта одной транзакцией (см. ScamDatabase.import_records)"""
+        result = Counter()
+        with self._write_transaction():
+            for entry in entries:
+                user_id = entry['user_id']
+                if user_id.isdigit() and config.is_admin(int(user_id)):
+                    result['skipped'] += 1
+                    continue
+                
+                user_data, is_new = merge_imported_entry(self._get(user_id), entry, added_by)
+                self._put(user_id, user_data)
+                result['added' if is_new else 'updated'] += 1
+        return result
+    
     def check_user(self, user_id: str) -> Optional[Dict]:
         """Проверка пользователя в базе"""
-        user_data = self.db.get(user_id)
+        user_data = self._get(user_id)
         if user_data and user_data.get('status') == 'active':
             return user_data
         return None
     
     def find_scammer_by_username(self, username: str) -> Optional[Dict]:
         """Поиск скамера по username (с @ или без)"""
-        clean_username = username.replace('@', '').lower()
-        
-        for user_id, info in self.db.items():
-            if info.get('status') == 'active':
-                db_username = info.get('username', '').replace('@', '').lower()
-                if db_username == clean_username:
-                    return info
-                if user_id == clean_username:
-                    return info
-        return None
+        clean_username = normalize_username(username)
+        # "+status" не дает планировщику взять индекс по статусу (почти все
+        # записи активны) вместо индексов по имени и ключу
+        rows = self._query(
+            "SELECT data FROM scammers WHERE +status = 'active' "
+            "AND (username_norm = ? OR key_norm = ?) LIMIT 1",
+            (clean_username, clean_username)
+        )
+        return rows[0] if rows else None
+    
+    def _update_fuzzy_index(self, key: str, info: Optional[Dict]):
+        """Перенести запись в индексе похожих имен (вызывать до записи в таблицу)"""
+        row = self.conn.execute("SELECT username, status FROM scammers WHERE key = ?", (key,)).fetchone()
+        if row and row[1] == 'active':
+            self._fuzzy_index.remove(row[0], key)
+        if info and info.get('status') == 'active':
+            self._fuzzy_index.add(info.get('username'), key)
+    
+    def find_similar(self, username: str, limit: int = FUZZY_SUGGESTIONS) -> List[Tuple[Dict, int]]:
+        """Активные скамеры с похожим username (см. ScamDatabase.find_similar)"""
+        if self._fuzzy_index is None:
+            self._fuzzy_index = FuzzyIndex()
+            for key, name in self.conn.execute("SELECT key, username FROM scammers WHERE status = 'active'"):
+                self._fuzzy_index.add(name, key)
+        
+        exact = {row[0] for row in self.conn.execute(
+            "SELECT key FROM scammers WHERE +status = 'active' AND username_norm = ?",
+            (normalize_username(username),)
+        )}
+        results = []
+        for key, distance in self._fuzzy_index.search(username, limit, exact):
+            user_data = self._get(key)
+            if user_data:
+                results.append((user_data, distance))
+        return results
+    
+    def find_by_prefix(self, prefix: str, limit: int = 20) -> List[Dict]:
+        """Активные скамеры, у которых username или ID начинается с prefix (см. ScamDatabase.find_by_prefix)"""
+        prefix = normalize_username(prefix)
+        if not prefix:
+            return []
+        # Диапазон по индексам вместо LIKE: LIKE с учетом регистра индекс не использует
+        upper = prefix + '\uffff'
+        return self._query(
+            "SELECT data FROM scammers WHERE +status = 'active' "
+            "AND ((username_norm >= ? AND username_norm < ?) OR (key_norm >= ? AND key_norm < ?)) "
+            "ORDER BY username_norm LIMIT ?",
+            (prefix, upper, prefix, upper, limit)
+        )
     
     def remove_scammer(self, user_id: str) -> bool:
         """Удаление скамера из базы"""
-        if user_id in self.db:
-            self.db[user_id]['status'] = 'removed'
-            self.db[user_id]['removed_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            self.save_db()
+        with self._write_transaction():
+            user_data = self._get(user_id)
+            if user_data is None:
+                return False
+            user_data['status'] = 'removed'
+            user_data['removed_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._put(user_id, user_data)
             return True
-        return False
     
     def permanently_delete_scammer(self, user_id: str) -> bool:
         """Полное удаление скамера из базы"""
-        if user_id in self.db:
-            del self.db[user_id]
-            self.save_db()
-            return True
-        return False
+        with self._write_transaction():
+            if self._fuzzy_index is not None:
+                self._update_fuzzy_index(user_id, None)
+            if self._cache is not None:
+                self._cache.invalidate(user_id)
+            cursor = self.conn.execute("DELETE FROM scammers WHERE key = ?", (user_id,))
+            return cursor.rowcount > 0
     
     def increment_reports(self, user_id: str):
         """Увеличение счетчика жалоб"""
-        if user_id in self.db:
-            self.db[user_id]['reports'] = self.db[user_id].get('reports', 0) + 1
-            self.save_db()
+        with self._write_transaction():
+            user_data = self._get(user_id)
+            if user_data is not None:
+                user_data['reports'] = user_data.get('reports', 0) + 1
+                self._put(user_id, user_data)
     
     def set_country(self, user_id: str, country: str):
         """Установка страны для скамера"""
-        if user_id in self.db:
-            self.db[user_id]['country'] = country
-            self.save_db()
+        with self._write_transaction():
+            user_data = self._get(user_id)
+            if user_data is not None:
+                user_data['country'] = normalize_country(country)
+                self._put(user_id, user_data)
+    
+    def cache_stats(self) -> Optional[Dict]:
+        """Кэш записей воркера (см. ScamDatabase.cache_stats); None вне общего режима"""
+        if self._cache is None:
+            return None
+        return {'size': len(self._cache), 'hits': self._cache.hits, 'misses': self._cache.misses}
     
     def get_stats(self) -> Dict:
-        """Получение статистики"""
-        active_scammers = [u for u in self.db.values() if u.get('status') == 'active']
-        total_scammers = len(active_scammers)
-        total_reports = sum(user.get('reports', 0) for user in active_scammers)
-        removed_scammers = len([u for u in self.db.values() if u.get('status') == 'removed'])
+        """Получение статистики (счетчики ведут триггеры)"""
+        stats = dict.fromkeys(self.STATS_NAMES, 0)
+        stats.update(self.conn.execute("SELECT name, value FROM stats"))
+        return stats
+    
+    def verify_stats(self) -> Dict:
+        """Пересчитать статистику с нуля и исправить расхождения.
         
-        return {
+        Возвращает {счетчик: (было, стало)} для счетчиков, которые разошлись.
+        """
+        total_scammers, total_reports = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(reports), 0) FROM scammers WHERE status = 'active'"
+        ).fetchone()
+        removed_scammers = self.conn.execute(
+            "SELECT COUNT(*) FROM scammers WHERE status = 'removed'"
+        ).fetchone()[0]
+        total_in_db = self.conn.execute("SELECT COUNT(*) FROM scammers").fetchone()[0]
+        actual = {
             'total_scammers': total_scammers,
             'total_reports': total_reports,
             'removed_scammers': removed_scammers,
-            'total_in_db': len(self.db)
+            'total_in_db': total_in_db
         }
+        
+        stored = dict(self.conn.execute("SELECT name, value FROM stats"))
+        drift = {name: (stored.get(name), value) for name, value in actual.items()
+                 if stored.get(name) != value}
+        if drift:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO stats (name, value) VALUES (?, ?)",
+                                      actual.items())
+            if len(stored) == len(self.STATS_NAMES):
+                logger.warning(f"Расхождение счетчиков статистики: {drift}")
+        return drift
     
     def search_by_country(self, country: str) -> List[Dict]:
         """Поиск скамеров по стране"""
-        return [user for user in self.db.values() 
-                if user.get('country', '').lower() == country.lower() 
-                and user.get('status') == 'active']
+        return self.search(country=country)
+    
+    def search(self, country: str = None, status: Optional[str] = 'active',
+               date_from: str = None, date_to: str = None,
+               min_reports: int = None, max_reports: int = None,
+               limit: int = None) -> List[Dict]:
+        """Поиск по стране, статусу, периоду добавления и числу жалоб (см. ScamDatabase.search)"""
+        sql, params = self._search_query(country, status, date_from, date_to, min_reports, max_reports)
+        sql += " ORDER BY added_date DESC, key DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._query(sql, tuple(params))
+    
+    @staticmethod
+    def _search_query(country: str = None, status: Optional[str] = 'active',
+                      date_from: str = None, date_to: str = None,
+                      min_reports: int = None, max_reports: int = None) -> Tuple[str, List]:
+        """SQL выборки по условиям поиска (без сортировки) и его параметры"""
+        conditions, params = [], []
+        if country:
+            conditions.append("country = ? COLLATE NOCASE")
+            params.append(normalize_country(country))
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if date_from:
+            conditions.append("added_date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("added_date <= ?")
+            params.append(date_to + '\uffff')
+        if min_reports is not None:
+            conditions.append("reports >= ?")
+            params.append(min_reports)
+        if max_reports is not None:
+            conditions.append("reports <= ?")
+            params.append(max_reports)
+        
+        sql = "SELECT data FROM scammers"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return sql, params
+    
+    async def export(self, path: str, fmt: str = 'ndjson', **filters) -> int:
+        """Выгрузить записи в сжатый файл (см. ScamDatabase.export).
+        
+        Чтение идет в потоке через отдельное соединение одной транзакцией:
+        в режиме WAL она видит базу на момент начала и не мешает записи.
+        """
+        sql, params = self._search_query(**filters)
+        
+        def run() -> int:
+            conn = sqlite3.connect(self.sqlite_file)
+            try:
+                conn.execute("BEGIN")
+                rows = conn.execute(sql, params)
+                return write_export_file(path, fmt, (json.loads(row[0]) for row in rows))
+            finally:
+                conn.close()
+        
+        return await asyncio.to_thread(run)
     
     def get_recent_scammers(self, limit: int = 10) -> List[Dict]:
         """Получение последних добавленных скамеров"""
-        active_scammers = [u for u in self.db.values() if u.get('status') == 'active']
-        sorted_scammers = sorted(active_scammers, 
-                                key=lambda x: x.get('added_date', ''), 
-                                reverse=True)
-        return sorted_scammers[:limit]
+        return self.get_recent_page(limit=limit)[0]
+    
+    def get_recent_page(self, cursor: Optional[str] = None, limit: int = 10) -> Tuple[List[Dict], Optional[str]]:
+        """Страница активных скамеров от новых к старым (см. ScamDatabase.get_recent_page)"""
+        if cursor:
+            added_date, user_id = parse_recent_cursor(cursor)
+            rows = self.conn.execute(
+                "SELECT added_date, key, data FROM scammers WHERE status = 'active' "
+                "AND (added_date < ? OR (added_date = ? AND key < ?)) "
+                "ORDER BY added_date DESC, key DESC LIMIT ?",
+                (added_date, added_date, user_id, limit + 1)
+            ).fetchall()
+        else:
+            rows = self.conn.execute(
+                "SELECT added_date, key, data FROM scammers WHERE status = 'active' "
+                "ORDER BY added_date DESC, key DESC LIMIT ?",
+                (limit + 1,)
+            ).fetchall()
+        
+        page = rows[:limit]
+        next_cursor = make_recent_cursor(page[-1][0] or '', page[-1][1]) if len(rows) > limit else None
+        return [json.loads(data) for _, _, data in page], next_cursor
+
+def get_shared_state_settings(config: Config) -> Optional[Dict]:
+    """Настройки общего режима для нескольких воркеров (None - режим выключен)"""
+    settings = dict(DEFAULT_CONFIG['shared_state'])
+    settings.update(config.config.get('shared_state') or {})
+    if not settings['enabled']:
+        return None
+    settings['workers'] = max(1, int(settings['workers']))
+    return settings
+
+def create_database(config: Config):
+    """Создать хранилище базы согласно настройкам storage_backend и shared_state"""
+    backend = config.config.get('storage_backend', 'json')
+    if get_shared_state_settings(config):
+        if backend != 'sqlite':
+            logger.warning("Общий режим (shared_state) работает только с SQLite, используется sqlite")
+        database = SQLiteScamDatabase(shared=True)
+        config.attach_store(database)
+        return database
+    if backend == 'sqlite':
+        return SQLiteScamDatabase()
+    if backend != 'json':
+        logger.warning(f"Неизвестное хранилище '{backend}', используется json")
+    return ScamDatabase(write_behind=config.config.get('write_behind'))
+
+def flush_pending_writes():
+    """Сбросить на диск все отложенные изменения базы и конфига"""
+    db.flush()
+    config.flush()
 
 # Инициализация
 config = Config()
-db = ScamDatabase()
+db = create_database(config)
+atexit.register(flush_pending_writes)
+subscription_cache = TTLCache(SUBSCRIPTION_CACHE_SIZE, SUBSCRIPTION_CACHE_TTL)
 telegram_api = None
 
 # Проверка прав
 def has_permission(user_id: int, required_role: UserRole) -> bool:
     """Проверка наличия прав у пользователя"""
-    user_role = config.get_user_role(user_id)
-    
-    role_hierarchy = {
-        UserRole.USER: 0,
-        UserRole.ADMIN: 1,
-        UserRole.SPECIAL_ADMIN: 2,
-        UserRole.OWNER: 3
-    }
-    
-    return role_hierarchy[user_role] >= role_hierarchy[required_role]
+    return ROLE_LEVELS[config.get_user_role(user_id)] >= ROLE_LEVELS[required_role]
 
 def can_add_scammer(user_id: int, chat_id: int) -> bool:
     """Проверка, может ли пользователь добавлять скамеров в данном чате"""
@@ -549,6 +3012,233 @@ def can_add_scammer(user_id: int, chat_id: int) -> bool:
     
     return False
 
+class ThrottledUpdateProcessor(BaseUpdateProcessor):
+    """Планировщик обновлений: приоритеты и ограничение частоты по пользователям.
+    
+    Каждому пользователю выдается корзина токенов (THROTTLE_BURST штук,
+    пополнение THROTTLE_RATE в секунду) и отдельная корзина для inline-запросов
+    (THROTTLE_INLINE_BURST, THROTTLE_INLINE_RATE), чтобы набор имени в inline
+    не расходовал токены команд. Запрос без токена отбрасывается с коротким
+    ответом. Принятые обновления ждут одного из CONCURRENT_UPDATES мест,
+    которые раздаются сначала админам, затем командам, затем кнопкам.
+    """
+    def __init__(self, workers: int = CONCURRENT_UPDATES, backlog: int = UPDATE_BACKLOG_LIMIT):
+        super().__init__(max(workers, backlog))
+        self._gate = PriorityGate(workers)
+        self._buckets: Dict[int, Tuple[float, float]] = {}  # пользователь -> (токены, время)
+        self._inline_buckets: Dict[int, Tuple[float, float]] = {}
+        self._last_notice: Dict[int, float] = {}
+        self.processed = Counter()
+        self.shed = 0
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    @staticmethod
+    def classify(update: object) -> Tuple[int, Optional[int]]:
+        """Приоритет обновления и пользователь, к которому применяется ограничение"""
+        if not isinstance(update, Update) or update.effective_user is None:
+            return PRIORITY_ADMIN, None
+        user_id = update.effective_user.id
+        chat = update.effective_chat
+        if config.is_admin(user_id) or (chat is not None and config.is_admin_chat(chat.id)):
+            return PRIORITY_ADMIN, None
+        if update.chat_member or update.my_chat_member:
+            return PRIORITY_ADMIN, None
+        if update.callback_query:
+            return PRIORITY_BUTTONS, user_id
+        return PRIORITY_INTERACTIVE, user_id
+    
+    def _take_token(self, user_id: int, inline: bool = False) -> bool:
+        """Взять токен из корзины пользователя (inline - из корзины inline-запросов)"""
+        if inline:
+            buckets, burst, rate = self._inline_buckets, THROTTLE_INLINE_BURST, THROTTLE_INLINE_RATE
+        else:
+            buckets, burst, rate = self._buckets, THROTTLE_BURST, THROTTLE_RATE
+        now = time.monotonic()
+        tokens, updated = buckets.get(user_id, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            buckets[user_id] = (tokens, now)
+            return False
+        buckets[user_id] = (tokens - 1, now)
+        
+        # Полные корзины хранить незачем
+        if len(buckets) > USER_CACHE_SIZE:
+            refill_time = burst / rate
+            for key in [key for key, value in buckets.items() if now - value[1] >= refill_time]:
+                del buckets[key]
+            self._last_notice = {key: value for key, value in self._last_notice.items()
+                                 if now - value < THROTTLE_NOTICE_INTERVAL}
+        return True
+    
+    async def _notify_throttled(self, update: Update, user_id: int):
+        """Короткий ответ на отброшенный запрос (не чаще раза в THROTTLE_NOTICE_INTERVAL)"""
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Слишком много нажатий, подождите немного.")
+                return
+            
+            now = time.monotonic()
+            if now - self._last_notice.get(user_id, 0) < THROTTLE_NOTICE_INTERVAL:
+                return
+            self._last_notice[user_id] = now
+            if update.message and update.message.text and update.message.text.startswith('/'):
+                await update.message.reply_text("⏳ Слишком много запросов. Подождите несколько секунд.")
+        except Exception as e:
+            logger.debug(f"Не удалось ответить на отброшенный запрос: {e}")
+    
+    async def do_process_update(self, update: object, coroutine):
+        priority, user_id = self.classify(update)
+        inline = isinstance(update, Update) and update.inline_query is not None
+        
+        if user_id is not None and not self._take_token(user_id, inline):
+            coroutine.close()
+            self.shed += 1
+            await self._notify_throttled(update, user_id)
+            return
+        
+        await self._gate.acquire(priority)
+        try:
+            self.processed[priority] += 1
+            # Обновление выполняется в своей задаче: память ролей только его
+            role_memo.set({})
+            await coroutine
+        finally:
+            self._gate.release()
+    
+    @property
+    def queued(self) -> int:
+        """Сколько принятых обновлений ждет свободного места"""
+        return len(self._gate)
+
+class RateWindow:
+    """Корзина токенов с резервированием: reserve() сразу списывает токен
+    и возвращает, сколько секунд ждать до отправки
+    """
+    def __init__(self, burst: int, rate: float):
+        self.burst = burst
+        self.rate = rate
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+    
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        return max(delay, self._blocked_until - now)
+    
+    def block(self, seconds: float):
+        """Не отправлять ничего seconds секунд (после RetryAfter)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+    
+    def is_idle(self) -> bool:
+        """Корзина полна и не заблокирована - хранить ее незачем"""
+        now = time.monotonic()
+        return (now >= self._blocked_until
+                and self._tokens + (now - self._updated) * self.rate >= self.burst)
+
+class FloodAwareRateLimiter(BaseRateLimiter):
+    """Очередь исходящих сообщений с учетом лимитов Telegram.
+    
+    Отправки сообщений выдерживают общий лимит бота и лимит чата (группы
+    строже личных чатов). RetryAfter блокирует чат на указанное время и
+    повторяется: в обработчиках - один раз и недолго, для фоновых отправок
+    (rate_limit_args = число повторов) - столько раз, сколько задано.
+    """
+    SEND_METHODS = ('send', 'copyMessage', 'forwardMessage')
+    
+    def __init__(self, workers: int = 1):
+        # Лимит на бота общий для всех воркеров (режим shared_state): делим его поровну
+        self._global = RateWindow(max(1, OUTBOUND_GLOBAL_BURST // workers), OUTBOUND_GLOBAL_RATE / workers)
+        self._chats: Dict[str, RateWindow] = {}
+        self.waiting = 0
+        self.retries = 0
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+    
+    def _chat_window(self, chat_id) -> RateWindow:
+        key = str(chat_id)
+        window = self._chats.get(key)
+        if window is None:
+            if len(self._chats) > USER_CACHE_SIZE:
+                self._chats = {k: w for k, w in self._chats.items() if not w.is_idle()}
+            # Отрицательные ID и @username - группы и каналы
+            if key.startswith('-') or key.startswith('@'):
+                window = RateWindow(OUTBOUND_GROUP_BURST, OUTBOUND_GROUP_RATE)
+            else:
+                window = RateWindow(OUTBOUND_PRIVATE_BURST, OUTBOUND_PRIVATE_RATE)
+            self._chats[key] = window
+        return window
+    
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        background = rate_limit_args is not None
+        max_retries = rate_limit_args if background else OUTBOUND_INTERACTIVE_RETRIES
+        chat_id = data.get('chat_id')
+        
+        windows = []
+        if endpoint.startswith(self.SEND_METHODS):
+            windows.append(self._global)
+            if chat_id is not None:
+                windows.append(self._chat_window(chat_id))
+        
+        for attempt in range(max_retries + 1):
+            delay = max((window.reserve() for window in windows), default=0.0)
+            if delay > 0:
+                self.waiting += 1
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self.waiting -= 1
+            
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retry_after = float(e.retry_after)
+                # Ограничение от Telegram относится к чату, а без чата - ко всему боту
+                (self._chat_window(chat_id) if chat_id is not None else self._global).block(retry_after)
+                self.retries += 1
+                if attempt == max_retries or (not background and retry_after > OUTBOUND_INTERACTIVE_MAX_WAIT):
+                    raise
+                logger.warning(f"RetryAfter {retry_after} с для {endpoint} в чат {chat_id}, повторяю")
+        return None
+
+# Фоновые отправки, которые еще не завершились
+background_sends: set = set()
+
+def send_in_background(bot, chat_id, text: str, **kwargs):
+    """Отправить неинтерактивное сообщение (уведомление) в фоне.
+    
+    Обработчик не ждет отправки; при RetryAfter сообщение повторяется до
+    OUTBOUND_BACKGROUND_RETRIES раз.
+    """
+    async def send():
+        try:
+            await bot.send_message(chat_id=chat_id, text=text,
+                                   rate_limit_args=OUTBOUND_BACKGROUND_RETRIES, **kwargs)
+        except Exception as e:
+            logger.error(f"Не удалось отправить уведомление в {chat_id}: {e}")
+    
+    task = asyncio.ensure_future(send())
+    background_sends.add(task)
+    task.add_done_callback(background_sends.discard)
+    return task
+
+def remember_subscription(user_id: int, is_subscribed: bool):
+    """Запомнить результат проверки подписки"""
+    ttl = SUBSCRIPTION_CACHE_TTL if is_subscribed else SUBSCRIPTION_CACHE_NEGATIVE_TTL
+    subscription_cache.set(user_id, is_subscribed, ttl)
+
 async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """Проверка подписки пользователя на канал"""
     try:
@@ -560,6 +3250,10 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
         if config.is_admin(user_id):
             return True
             
+        found, cached_verdict = subscription_cache.get(user_id)
+        if found:
+            return cached_verdict
+        
         channel_info = config.get_required_channel()
         channel_id = channel_info['id']
         
@@ -568,10 +3262,9 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
             chat_member = await context.bot.get_chat_member(chat_id=channel_id, user_id=user_id)
             
             # Проверяем статусы, которые означают подписку
-            if chat_member.status in ['member', 'administrator', 'creator', 'owner']:
-                return True
-            else:
-                return False
+            is_subscribed = chat_member.status in SUBSCRIBED_STATUSES
+            remember_subscription(user_id, is_subscribed)
+            return is_subscribed
                 
         except Exception as e:
             logger.error(f"Ошибка проверки подписки пользователя {user_id}: {e}")
@@ -614,6 +3307,36 @@ async def require_subscription(update: Update, context: ContextTypes.DEFAULT_TYP
     
     return True
 
+async def subscription_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверка подписки до обработчиков команд (группа -1).
+    
+    Если пользователь не подписан, показываем предложение подписаться и
+    останавливаем дальнейшую обработку обновления.
+    """
+    if not update.message or not update.message.text or not update.effective_user:
+        return
+    
+    command, _, bot_name = update.message.text.split()[0][1:].partition('@')
+    if bot_name and bot_name.lower() != (context.bot.username or '').lower():
+        # Команда в группе адресована другому боту
+        return
+    if command.lower() not in SUBSCRIPTION_COMMANDS:
+        return
+    
+    if not await require_subscription(update, context):
+        raise ApplicationHandlerStop
+
+async def track_channel_membership(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обновление кэша подписки при вступлении/выходе из канала"""
+    member_update = update.chat_member
+    if member_update.chat.id != config.get_required_channel()['id']:
+        return
+    
+    user_id = member_update.new_chat_member.user.id
+    is_subscribed = member_update.new_chat_member.status in SUBSCRIBED_STATUSES
+    remember_subscription(user_id, is_subscribed)
+    logger.info(f"Подписка пользователя {user_id} на канал: {'да' if is_subscribed else 'нет'}")
+
 async def check_subscription_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик кнопки проверки подписки"""
     query = update.callback_query
@@ -622,7 +3345,8 @@ async def check_subscription_button(update: Update, context: ContextTypes.DEFAUL
     user_id = query.from_user.id
     
     if query.data == "check_subscription":
-        # Проверяем подписку еще раз
+        # Проверяем подписку еще раз, не доверяя кэшу
+        subscription_cache.invalidate(user_id)
         is_subscribed = await check_subscription(user_id, context)
         
         if is_subscribed:
@@ -783,18 +3507,16 @@ async def add_admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode='Markdown'
             )
             
-            try:
-                await context.bot.send_message(
-                    chat_id=int(new_admin_id),
-                    text=f"🎉 *Вы назначены администратором!*\n\n"
-                         f"🤖 Бот: @{BOT_USERNAME}\n"
-                         f"👮 Роль: Обычный администратор\n"
-                         f"🛠️ Права: Можете добавлять скамеров в админ-чате\n\n"
-                         f"💬 Админ-чат: Настройте у владельца",
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить нового админа: {e}")
+            send_in_background(
+                context.bot,
+                int(new_admin_id),
+                f"🎉 *Вы назначены администратором!*\n\n"
+                f"🤖 Бот: @{BOT_USERNAME}\n"
+                f"👮 Роль: Обычный администратор\n"
+                f"🛠️ Права: Можете добавлять скамеров в админ-чате\n\n"
+                f"💬 Админ-чат: Настройте у владельца",
+                parse_mode='Markdown'
+            )
         else:
             await update.message.reply_text(f"❌ {message}")
             
@@ -840,18 +3562,16 @@ async def add_special_admin_command(update: Update, context: ContextTypes.DEFAUL
                 parse_mode='Markdown'
             )
             
-            try:
-                await context.bot.send_message(
-                    chat_id=int(new_admin_id),
-                    text=f"🎉 *Вы назначены спец-администратором!*\n\n"
-                         f"🤖 Бот: @{BOT_USERNAME}\n"
-                         f"👮 Роль: Спец-администратор\n"
-                         f"🛠️ Права: Можете добавлять и удалять скамеров\n\n"
-                         f"💬 Админ-чат: Настройте у владельца",
-                    parse_mode='Markdown'
-                )
-            except Exception as e:
-                logger.error(f"Не удалось уведомить нового спец-админа: {e}")
+            send_in_background(
+                context.bot,
+                int(new_admin_id),
+                f"🎉 *Вы назначены спец-администратором!*\n\n"
+                f"🤖 Бот: @{BOT_USERNAME}\n"
+                f"👮 Роль: Спец-администратор\n"
+                f"🛠️ Права: Можете добавлять и удалять скамеров\n\n"
+                f"💬 Админ-чат: Настройте у владельца",
+                parse_mode='Markdown'
+            )
         else:
             await update.message.reply_text(f"❌ {message}")
             
@@ -1022,52 +3742,31 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             chat_id=chat_id,
             proof_link=proof_link
         )
+        scammer_info = None
+        if success:
+            scammer_info = db.check_user(user_id_to_add) or db.find_scammer_by_username(username)
         
         if success:
-            scammer_info = db.check_user(user_id_to_add)
-            if not scammer_info:
-                scammer_info = db.find_scammer_by_username(username)
-            
             display_username = username
             if not display_username.startswith('@'):
                 display_username = f"@{display_username}"
             
-            warning_image = config.get_image_file("warning")
             try:
-                if warning_image and os.path.exists(warning_image):
-                    with open(warning_image, 'rb') as photo:
-                        await update.message.reply_photo(
-                            photo=photo,
-                            caption=f"""
-⚠️ *СКАМЕР ДОБАВЛЕН!*
-
-👤 *Пользователь:* {display_username}
-🆔 *ID:* `{user_id_to_add}`
-📝 *Причина:* {reason}
-📊 *Жалоб:* {scammer_info['reports'] if scammer_info else 1}
-👮 *Добавил:* {get_admin_role_text(user_id)}
-📅 *Дата:* {datetime.now().strftime('%d.%m.%Y %H:%M')}
-🔗 *Доказательство:* {proof_link}
-
-✅ *{'Новая запись добавлена' if is_new else 'Запись обновлена'} в базе данных!*
-                            """,
-                            parse_mode='Markdown'
-                        )
-                else:
-                    await update.message.reply_text(
-                        f"⚠️ *СКАМЕР ДОБАВЛЕН!*\n\n"
-                        f"👤 *Пользователь:* {display_username}\n"
-                        f"🆔 *ID:* `{user_id_to_add}`\n"
-                        f"📝 *Причина:* {reason}\n"
-                        f"📊 *Жалоб:* {scammer_info['reports'] if scammer_info else 1}\n"
-                        f"👮 *Добавил:* {get_admin_role_text(user_id)}\n"
-                        f"📅 *Дата:* {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
-                        f"🔗 *Доказательство:* {proof_link}\n\n"
-                        f"✅ *{'Новая запись добавлена' if is_new else 'Запись обновлена'} в базе данных!*",
-                        parse_mode='Markdown'
-                    )
+                await reply_card(
+                    update.message,
+                    "warning",
+                    f"⚠️ *СКАМЕР ДОБАВЛЕН!*\n\n"
+                    f"👤 *Пользователь:* {display_username}\n"
+                    f"🆔 *ID:* `{user_id_to_add}`\n"
+                    f"📝 *Причина:* {reason}\n"
+                    f"📊 *Жалоб:* {scammer_info['reports'] if scammer_info else 1}\n"
+                    f"👮 *Добавил:* {get_admin_role_text(user_id)}\n"
+                    f"📅 *Дата:* {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
+                    f"🔗 *Доказательство:* {proof_link}\n\n"
+                    f"✅ *{'Новая запись добавлена' if is_new else 'Запись обновлена'} в базе данных!*"
+                )
             except Exception as e:
-                logger.error(f"Ошибка отправки фото: {e}")
+                logger.error(f"Ошибка отправки карточки: {e}")
                 await update.message.reply_text(
                     f"✅ Скамер {display_username} {'добавлен' if is_new else 'обновлен'} в базе!\n"
                     f"Причина: {reason}\n"
@@ -1081,21 +3780,19 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Хотите указать страну скамера?", reply_markup=reply_markup)
             
             if config.config['owner_id']:
-                try:
-                    await context.bot.send_message(
-                        chat_id=config.config['owner_id'],
-                        text=f"🔔 *Новый скамер {'добавлен' if is_new else 'обновлен'}!*\n\n"
-                             f"👤 {display_username}\n"
-                             f"🆔 `{user_id_to_add}`\n"
-                             f"📝 {reason}\n"
-                             f"📊 Жалоб: {scammer_info['reports'] if scammer_info else 1}\n"
-                             f"👮 Добавил: {get_admin_role_text(user_id)}\n"
-                             f"💬 Чат: Админ-чат\n"
-                             f"🔗 Доказательство: {proof_link}",
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка уведомления владельца: {e}")
+                send_in_background(
+                    context.bot,
+                    config.config['owner_id'],
+                    f"🔔 *Новый скамер {'добавлен' if is_new else 'обновлен'}!*\n\n"
+                    f"👤 {display_username}\n"
+                    f"🆔 `{user_id_to_add}`\n"
+                    f"📝 {reason}\n"
+                    f"📊 Жалоб: {scammer_info['reports'] if scammer_info else 1}\n"
+                    f"👮 Добавил: {get_admin_role_text(user_id)}\n"
+                    f"💬 Чат: Админ-чат\n"
+                    f"🔗 Доказательство: {proof_link}",
+                    parse_mode='Markdown'
+                )
         else:
             await update.message.reply_text(f"⚠️ {message}")
             
@@ -1105,11 +3802,6 @@ async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start с кнопочным меню"""
-    # Проверяем подписку
-    is_subscribed = await require_subscription(update, context)
-    if not is_subscribed:
-        return
-    
     user_id = update.effective_user.id
     user_role = config.get_user_role(user_id)
     
@@ -1162,7 +3854,188 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ⚠️ *Всегда используйте гарантов для безопасных сделок!*
     """
     
-    await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=reply_markup)
+    await update.message.reply_text(welcome_text, parse_mode='Markdown', reply_markup=reply_markup)
+
+# ====== ИМПОРТ БАЗЫ ======
+
+async def resolve_import_entries(entries: List[Dict]):
+    """Найти ID через User API для записей, где известен только username"""
+    semaphore = asyncio.Semaphore(CHECKMANY_CONCURRENCY)
+    
+    async def resolve(entry: Dict):
+        async with semaphore:
+            real_user_id, real_username = await get_user_info_from_tg(entry['user_id'])
+        if real_user_id and real_user_id.isdigit():
+            entry['user_id'] = real_user_id
+    
+    await asyncio.gather(*(resolve(entry) for entry in entries if not entry['user_id'].isdigit()))
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт базы из файла JSON, NDJSON или CSV (только владелец).
+    
+    Файл отправляется с подписью /import или команда /import пишется
+    ответом на сообщение с файлом. /import resolve - дополнительно искать
+    ID по username через Telegram.
+    """
+    message = update.message
+    tmp_path = None
+    try:
+        user_id = update.effective_user.id
+        if not has_permission(user_id, UserRole.OWNER):
+            await message.reply_text("❌ Только владелец может импортировать базу!")
+            return
+        
+        document = message.document
+        if not document and message.reply_to_message:
+            document = message.reply_to_message.document
+        if not document:
+            await message.reply_text(
+                "📥 *Импорт базы*\n\n"
+                "Отправьте файл JSON, NDJSON или CSV с подписью `/import` "
+                "или ответьте `/import` на сообщение с файлом.\n\n"
+                "Поля: `user_id`, `username`, `reasons`, `proofs`, `reports`, `country`\n"
+                "`/import resolve` - искать ID по username через Telegram",
+                parse_mode='Markdown'
+            )
+            return
+        
+        if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+            await message.reply_text("❌ Файл больше 20 МБ: Telegram не дает боту скачать его.")
+            return
+        
+        words = (message.text or message.caption or '').lower().split()
+        resolve = 'resolve' in words[1:]
+        
+        status_msg = await message.reply_text("📥 Скачиваю файл...")
+        file = await context.bot.get_file(document.file_id)
+        tmp_path = os.path.join(os.path.dirname(DB_FILE), f"import_{message.message_id}.tmp")
+        await file.download_to_drive(tmp_path)
+        
+        started = time.monotonic()
+        last_progress = started
+        stats = Counter()
+        error = None
+        batch = []
+        
+        async def commit_batch():
+            if resolve:
+                await resolve_import_entries(batch)
+            stats.update(db.import_records(batch, user_id))
+            batch.clear()
+            # Отдаем управление другим обработчикам между пачками
+            await asyncio.sleep(0)
+        
+        with open(tmp_path, 'r', encoding='utf-8-sig', newline='') as f:
+            try:
+                for key, raw in iter_import_entries(f, document.file_name):
+                    stats['read'] += 1
+                    entry = normalize_import_entry(key, raw)
+                    if entry is None:
+                        stats['invalid'] += 1
+                        continue
+                    batch.append(entry)
+                    
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        await commit_batch()
+                        if time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL:
+                            last_progress = time.monotonic()
+                            await status_msg.edit_text(
+                                f"📥 Импорт: обработано {stats['read']} записей "
+                                f"(новых {stats['added']}, обновлено {stats['updated']})..."
+                            )
+            except (ValueError, csv.Error) as e:
+                # Уже разобранное сохраняем, об ошибке сообщаем в итогах
+                error = str(e)
+                logger.error(f"Ошибка разбора файла импорта: {e}")
+        
+        if batch:
+            await commit_batch()
+        # Ждем фоновое сжатие, а не пишем снапшот параллельно с ним
+        saved = await db.compact(wait=True)
+        
+        summary = (
+            f"✅ *Импорт завершен* за {time.monotonic() - started:.1f} с\n\n"
+            f"📄 Прочитано записей: {stats['read']}\n"
+            f"🆕 Добавлено: {stats['added']}\n"
+            f"🔄 Обновлено: {stats['updated']}\n"
+            f"⏭️ Пропущено (админы): {stats['skipped']}\n"
+            f"⚠️ Некорректных: {stats['invalid']}\n"
+            f"📊 Всего скамеров в базе: {db.get_stats()['total_scammers']}"
+        )
+        if error:
+            summary += f"\n\n❌ Разбор остановлен на ошибке: `{escape_markdown(error)}`"
+        if not saved:
+            if db.flush():
+                summary += ("\n\n⚠️ Не удалось записать снапшот базы (см. лог): "
+                            "изменения сохранены в журнал и попадут в снапшот при следующем сжатии")
+            else:
+                summary += ("\n\n❌ Не удалось сохранить импорт на диск (см. лог): "
+                            "изменения есть только в памяти бота")
+        await status_msg.edit_text(summary, parse_mode='Markdown')
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /import: {e}", exc_info=True)
+        await message.reply_text("❌ Произошла ошибка при импорте. Попробуйте позже.")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка базы в сжатый NDJSON или CSV (владелец и спец-админы).
+    
+    Пример: /export csv RU from=2026-01-01 status=all
+    """
+    tmp_path = None
+    try:
+        user_id = update.effective_user.id
+        if not has_permission(user_id, UserRole.SPECIAL_ADMIN):
+            await update.message.reply_text("❌ У вас нет прав для выгрузки базы!")
+            return
+        
+        args = list(context.args or [])
+        fmt = 'ndjson'
+        for arg in list(args):
+            if arg.lower() in EXPORT_FORMATS:
+                fmt = arg.lower()
+                args.remove(arg)
+        
+        try:
+            filters = parse_search_args(args)
+        except ValueError as e:
+            await update.message.reply_text(
+                f"❌ {e}\n\n"
+                "*Пример:* `/export csv RU from=2026-01-01 to=2026-01-31 status=all reports>=2`\n"
+                "Формат: `ndjson` (по умолчанию) или `csv`",
+                parse_mode='Markdown'
+            )
+            return
+        
+        status_msg = await update.message.reply_text("📤 Готовлю выгрузку...")
+        started = time.monotonic()
+        tmp_path = os.path.join(os.path.dirname(DB_FILE), f"export_{update.message.message_id}.tmp")
+        count = await db.export(tmp_path, fmt, **filters)
+        
+        size = os.path.getsize(tmp_path)
+        if size > EXPORT_MAX_FILE_SIZE:
+            await status_msg.edit_text("❌ Файл выгрузки больше 50 МБ. Сузьте условия выгрузки.")
+            return
+        
+        filename = f"scammers_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}.gz"
+        with open(tmp_path, 'rb') as f:
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id,
+                document=f,
+                filename=filename,
+                caption=f"📤 Выгружено записей: {count} ({size / 1024:.1f} КБ) за {time.monotonic() - started:.1f} с"
+            )
+        await status_msg.delete()
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /export: {e}", exc_info=True)
+        await update.message.reply_text("❌ Произошла ошибка при выгрузке. Попробуйте позже.")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 # ====== МЕНЮ КОМАНД ======
 
@@ -1181,6 +4054,7 @@ async def show_basic_commands_menu(update: Update, context: ContextTypes.DEFAULT
 • `/check 123456789` - по ID
 • `/check https://t.me/username` - по ссылке
 
+📋 */checkmany* - Проверить список (по одному в строке, до 50)
 👤 */checkme* - Проверить себя
 📊 */stats* - Статистика базы данных
 📚 */help* - Полная помощь по командам
@@ -1209,6 +4083,9 @@ async def show_admin_commands_menu(update: Update, context: ContextTypes.DEFAULT
 📝 */add @username Причина* - Добавить/обновить скамера
 *Пример:* `/add @scammer123 Обман при продаже аккаунта`
 
+🕒 */recent* - Последние добавленные скамеры
+🔎 */search RU from=2026-01-01 reports>=2* - Поиск по стране, периоду, статусу и жалобам
+
 *Для управления админами:*
 👥 */listadmins* - Список всех администраторов
 
@@ -1287,6 +4164,10 @@ async def show_owner_commands_menu(update: Update, context: ContextTypes.DEFAULT
 
 *Дополнительные команды:*
 🆔 */getchannelid* - Получить ID текущего чата
+🧮 */verifystats* - Пересчитать счетчики статистики
+📈 */metrics* - Метрики кэшей и очередей
+📥 */import* - Импорт базы из файла JSON/NDJSON/CSV
+📤 */export* - Выгрузка базы в NDJSON/CSV (gzip)
 
 *Ваша роль:* {get_admin_role_text(user_id)}
     """
@@ -1295,11 +4176,6 @@ async def show_owner_commands_menu(update: Update, context: ContextTypes.DEFAULT
 
 async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /check - работает везде"""
-    # Проверяем подписку
-    is_subscribed = await require_subscription(update, context)
-    if not is_subscribed:
-        return
-    
     try:
         if not context.args:
             await update.message.reply_text(
@@ -1313,6 +4189,11 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
         
+        # Несколько строк после /check - массовая проверка
+        if len(parse_identifier_list(update.message.text)) > 1 and '\n' in update.message.text.strip():
+            await checkmany_command(update, context)
+            return
+        
         user_identifier = ' '.join(context.args)
         
         if user_identifier.startswith('https://t.me/'):
@@ -1355,16 +4236,16 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 pass
         
         if scammer_info:
-            image_file = config.get_image_file("scammer_found")
+            image_type = "scammer_found"
             status_emoji = "🔴"
             status_text = "ЧЕЛОВЕК ЕСТЬ В БАЗЕ!"
             scam_chance = 100
-            country = scammer_info.get('country') or 'None'
+            country = country_display(scammer_info.get('country')) or 'None'
             reports = scammer_info.get('reports', 1)
             username_display = scammer_info['username']
             user_id_display = scammer_info['user_id']
         elif is_admin_user:
-            image_file = config.get_image_file("admin")
+            image_type = "admin"
             status_emoji = "🔵"
             status_text = "АДМИНИСТРАТОР БОТА"
             scam_chance = 0
@@ -1373,7 +4254,7 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             username_display = display_username
             user_id_display = display_user_id if display_user_id.isdigit() else 'Админ'
         else:
-            image_file = config.get_image_file("user_clean")
+            image_type = "user_clean"
             status_emoji = "🟢"
             status_text = "ЧЕЛОВЕКА НЕТ В БАЗЕ!"
             scam_chance = random.randint(1, 10)
@@ -1406,6 +4287,19 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if not scammer_info and not is_admin_user:
             response += "\n*НЕТ В БАЗЕ*"
+            
+            # Ищем по введенному username, а при проверке по ID - по username из Telegram
+            similar_name = user_identifier.replace('@', '').strip()
+            if similar_name.isdigit():
+                similar_name = real_username or ''
+            similar = db.find_similar(similar_name) if re.fullmatch(r'\w+', similar_name) else []
+            if similar:
+                response += "\n\n⚠️ *Похожие username в базе:*\n"
+                for similar_info, distance in similar:
+                    response += (
+                        f"• @{escape_markdown(str(similar_info['username']).lstrip('@'))} "
+                        f"`{similar_info['user_id']}` — жалоб: {similar_info.get('reports', 1)}\n"
+                    )
         
         keyboard = [
             [
@@ -1426,20 +4320,7 @@ async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        try:
-            if image_file and os.path.exists(image_file):
-                with open(image_file, 'rb') as photo:
-                    await update.message.reply_photo(
-                        photo=photo,
-                        caption=response,
-                        parse_mode='Markdown',
-                        reply_markup=reply_markup
-                    )
-            else:
-                await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
-        except Exception as e:
-            logger.error(f"Ошибка отправки фото: {e}")
-            await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
+        await reply_card(update.message, image_type, response, reply_markup)
     except Exception as e:
         logger.error(f"Ошибка в команде /check: {e}", exc_info=True)
         await update.message.reply_text("❌ Произошла ошибка при проверке. Попробуйте позже.")
@@ -1466,7 +4347,7 @@ async def show_profile(query, scammer_id: str):
 👤 *Username:* {username_display}
 🆔 *ID:* `{scammer_info['user_id']}`
 📊 *Жалоб:* {scammer_info.get('reports', 1)}
-🌍 *Страна:* {scammer_info.get('country', 'Не указана')}
+🌍 *Страна:* {country_display(scammer_info.get('country')) or 'Не указана'}
 📅 *Добавлен:* {scammer_info.get('added_date', 'Неизвестно')}
 👮 *Добавил:* Администратор
         
@@ -1566,9 +4447,13 @@ async def save_photo_to_file(context: ContextTypes.DEFAULT_TYPE, photo: PhotoSiz
         filename = f"{image_type}.jpg"
         save_path = os.path.join(IMAGES_FOLDER, filename)
         
-        await file.download_to_drive(save_path)
-        
-        config.update_image_file(image_type, save_path)
+        # Две одновременные загрузки не должны оставить файл от одной,
+        # а file_id от другой
+        async with config.lock:
+            await file.download_to_drive(save_path)
+            
+            # Фото уже загружено в Telegram: его file_id сразу подходит для ответов
+            config.update_image_file(image_type, save_path, photo.file_id)
         
         logger.info(f"Картинка сохранена: {save_path}")
         return save_path
@@ -1673,29 +4558,24 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
             parse_mode='Markdown'
         )
     
+    elif data.startswith("recent_"):
+        if not has_permission(user_id, UserRole.ADMIN):
+            await query.message.reply_text("❌ У вас нет прав для просмотра последних добавленных!")
+            return
+        
+        cursor = data.replace("recent_", "", 1)
+        recent_text, reply_markup = build_recent_page(None if cursor == "start" else cursor)
+        await query.message.edit_text(recent_text, parse_mode='Markdown', reply_markup=reply_markup)
+    
     elif data.startswith("remove_"):
         scammer_id = data.replace("remove_", "")
         await remove_scammer_dialog(query, user_id, scammer_id)
     
     elif data.startswith("country_"):
-        parts = data.split('_')
-        if len(parts) >= 3:
-            scammer_id = parts[1]
-            country_code = parts[2]
-            
-            country_names = {
-                'RU': '🇷🇺 Россия',
-                'UA': '🇺🇦 Украина',
-                'BY': '🇧🇾 Беларусь',
-                'KZ': '🇰🇿 Казахстан',
-                'US': '🇺🇸 США',
-                'EU': '🇪🇺 Европа',
-                'TR': '🇹🇷 Турция',
-                'AZ': '🇦🇿 Азербайджан'
-            }
-            
-            country_name = country_names.get(country_code, f"Страна {country_code}")
-            db.set_country(scammer_id, country_name)
+        scammer_id, _, country_code = data[len("country_"):].rpartition('_')
+        if scammer_id and country_code:
+            db.set_country(scammer_id, country_code)
+            country_name = country_display(country_code)
             
             await query.message.reply_text(f"✅ Страна установлена: {country_name}")
     
@@ -1706,7 +4586,8 @@ async def button_callback_handler(update: Update, context: ContextTypes.DEFAULT_
             await query.message.reply_text("❌ У вас нет прав для удаления скамеров!")
             return
         
-        if db.remove_scammer(scammer_id):
+        removed = db.remove_scammer(scammer_id)
+        if removed:
             await query.message.reply_text("✅ Скамер успешно удален из базы!")
         else:
             await query.message.reply_text("❌ Ошибка при удалении скамера.")
@@ -1772,11 +4653,6 @@ async def help_command_menu(query):
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /help"""
-    # Проверяем подписку
-    is_subscribed = await require_subscription(update, context)
-    if not is_subscribed:
-        return
-    
     user_id = update.effective_user.id
     user_role = config.get_user_role(user_id)
     
@@ -1784,6 +4660,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 📚 *Помощь по командам:*
 
 /check @username или ID - Проверить пользователя
+/checkmany - Проверить список пользователей (по одному в строке)
 /checkme - Проверить себя
 Занести скамера в базу - @wzkbScamBaseChat
 В случае возникновения технических неполадок обращайтесь в поддержку бота: @otecwzkb
@@ -1793,13 +4670,234 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
+def parse_identifier_list(text: str) -> List[str]:
+    """Разобрать список идентификаторов из текста команды.
+    
+    Принимает username, ID и ссылки t.me через пробел, запятую или с новой
+    строки; повторы убираются с сохранением порядка.
+    """
+    parts = re.split(r'[\s,;]+', text or '')
+    if parts and parts[0].startswith('/'):
+        parts = parts[1:]
+    
+    identifiers = []
+    seen = set()
+    for part in parts:
+        identifier = re.sub(r'^(https?://)?(t|telegram)\.me/', '', part).strip().lstrip('@').rstrip('/')
+        if not identifier or identifier.lower() in seen:
+            continue
+        seen.add(identifier.lower())
+        identifiers.append(identifier)
+    return identifiers
+
+async def check_identifier(identifier: str) -> Dict:
+    """Проверить один идентификатор для /checkmany"""
+    real_user_id, real_username = await get_user_info_from_tg(identifier)
+    
+    scammer_info = None
+    if real_user_id:
+        scammer_info = db.check_user(real_user_id)
+    if not scammer_info:
+        scammer_info = db.find_scammer_by_username(real_user_id or identifier)
+    
+    is_admin_user = False
+    if real_user_id and real_user_id.isdigit():
+        is_admin_user = config.is_admin(int(real_user_id))
+    
+    return {
+        'identifier': identifier,
+        'user_id': scammer_info['user_id'] if scammer_info else real_user_id,
+        'username': scammer_info['username'] if scammer_info else (real_username or identifier),
+        'scammer': scammer_info,
+        'is_admin': is_admin_user,
+    }
+
+async def checkmany_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /checkmany - проверка списка пользователей одним сообщением"""
+    try:
+        identifiers = parse_identifier_list(update.message.text)
+        if not identifiers:
+            await update.message.reply_text(
+                "❌ Укажите пользователей для проверки, по одному в строке:\n\n"
+                "`/checkmany\n@username1\n123456789\nhttps://t.me/username2`",
+                parse_mode='Markdown'
+            )
+            return
+        
+        skipped = max(0, len(identifiers) - CHECKMANY_LIMIT)
+        identifiers = identifiers[:CHECKMANY_LIMIT]
+        
+        # Ограничиваем число одновременных запросов к User API
+        semaphore = asyncio.Semaphore(CHECKMANY_CONCURRENCY)
+        
+        async def bounded_check(identifier: str) -> Dict:
+            async with semaphore:
+                return await check_identifier(identifier)
+        
+        results = await asyncio.gather(*(bounded_check(identifier) for identifier in identifiers))
+        
+        found = sum(1 for result in results if result['scammer'])
+        lines = []
+        for result in results:
+            username = escape_markdown(str(result['username']).lstrip('@'))
+            user_id = f" `{result['user_id']}`" if result['user_id'] else ""
+            scammer_info = result['scammer']
+            if scammer_info:
+                country = country_display(scammer_info.get('country'))
+                lines.append(
+                    f"🔴 @{username}{user_id} — жалоб: {scammer_info.get('reports', 1)}"
+                    f"{f' — {country}' if country else ''}"
+                )
+            elif result['is_admin']:
+                lines.append(f"🔵 @{username}{user_id} — администратор")
+            else:
+                lines.append(f"🟢 @{username}{user_id}")
+        
+        response = (
+            f"📋 *МАССОВАЯ ПРОВЕРКА*\n\n"
+            f"Проверено: *{len(results)}* | 🔴 В базе: *{found}* | 🟢 Нет в базе: *{len(results) - found}*\n\n"
+            + "\n".join(lines)
+        )
+        if skipped:
+            response += f"\n\n⚠️ Пропущено {skipped}: за раз можно проверить не больше {CHECKMANY_LIMIT}."
+        response += "\n\n⚠️ *Всегда идите через гарантов, чтобы сделки проходили безопасно!*"
+        
+        await update.message.reply_text(response, parse_mode='Markdown')
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /checkmany: {e}", exc_info=True)
+        await update.message.reply_text("❌ Произошла ошибка при проверке. Попробуйте позже.")
+
+def make_inline_result(result_id: str, user_id: str, username: str,
+                       scammer_info: Optional[Dict] = None) -> InlineQueryResultArticle:
+    """Карточка результата inline-поиска"""
+    username_display = escape_markdown(str(username or '').lstrip('@'))
+    if scammer_info:
+        country = country_display(scammer_info.get('country')) or 'None'
+        reports = scammer_info.get('reports', 1)
+        title = f"🔴 @{username_display} — ЕСТЬ В БАЗЕ"
+        description = f"ID: {user_id} | Жалоб: {reports} | Страна: {country}"
+        text = (
+            f"🔴 @{username_display} [{user_id}]\n\n"
+            f"*ЧЕЛОВЕК ЕСТЬ В БАЗЕ!*\n\n"
+            f"🎯 Шанс скама: *100%*\n"
+            f"🌍 Страна: {country}\n"
+            f"🔒 Жалоб: {reports}\n\n"
+        )
+    else:
+        title = f"🟢 @{username_display} — нет в базе"
+        description = f"ID: {user_id}"
+        text = (
+            f"🟢 @{username_display} [{user_id}]\n\n"
+            f"*ЧЕЛОВЕКА НЕТ В БАЗЕ!*\n\n"
+        )
+    text += f"⚠️ *Всегда идите через гарантов, чтобы сделки проходили безопасно!*\n\n@{BOT_USERNAME}"
+    
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(text, parse_mode='Markdown')
+    )
+
+# Последний inline-запрос каждого пользователя: более новый отменяет поиск через User API
+latest_inline_queries = TTLCache(INLINE_TRACK_SIZE, 60)
+
+async def inline_input_settled(query) -> bool:
+    """Подождать INLINE_RESOLVE_DELAY: True, если за это время от пользователя
+    не пришел более новый inline-запрос (он продолжил печатать)"""
+    await asyncio.sleep(INLINE_RESOLVE_DELAY)
+    found, latest_id = latest_inline_queries.get(query.from_user.id)
+    return found and latest_id == query.id
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Inline-поиск: @бот <начало username или ID> в любом чате.
+    
+    Ответ строится по локальному индексу базы. User API запрашивается
+    (через общий кэш) только для полного @username без точного совпадения
+    в базе и только когда пользователь перестал печатать.
+    """
+    query = update.inline_query
+    try:
+        latest_inline_queries.set(query.from_user.id, query.id)
+        identifiers = parse_identifier_list(query.query)
+        if not identifiers:
+            await query.answer([], cache_time=INLINE_CACHE_TIME)
+            return
+        prefix = identifiers[0]
+        clean_prefix = normalize_username(prefix)
+        
+        records = db.find_by_prefix(prefix, INLINE_RESULT_LIMIT)
+        results = [
+            make_inline_result(f"db_{record['user_id']}", record['user_id'], record['username'], record)
+            for record in records
+        ]
+        
+        exact_match = any(
+            clean_prefix in (normalize_username(record['username']), str(record['user_id']))
+            for record in records
+        )
+        if (not exact_match and query.query.strip().startswith('@')
+                and re.fullmatch(r'[a-z][a-z0-9_]{4,31}', clean_prefix)
+                and await inline_input_settled(query)):
+            real_user_id, real_username = await get_user_info_from_tg(prefix)
+            if real_user_id:
+                scammer_info = db.check_user(real_user_id)
+                if not any(str(record['user_id']) == real_user_id for record in records):
+                    results.insert(0, make_inline_result(
+                        f"tg_{real_user_id}", real_user_id, real_username, scammer_info
+                    ))
+        
+        await query.answer(results[:INLINE_RESULT_LIMIT], cache_time=INLINE_CACHE_TIME)
+        
+    except Exception as e:
+        logger.error(f"Ошибка inline-поиска: {e}", exc_info=True)
+
+async def reply_card(message, image_type: str, text: str, reply_markup=None):
+    """Ответить карточкой с картинкой указанного типа.
+    
+    Повторно использует file_id, который Telegram выдал при первой загрузке,
+    и загружает файл с диска только если file_id еще нет или он устарел.
+    Без картинки отвечает обычным текстом.
+    """
+    file_id = config.get_image_file_id(image_type)
+    if file_id:
+        try:
+            await message.reply_photo(
+                photo=file_id,
+                caption=text,
+                parse_mode='Markdown',
+                reply_markup=reply_markup
+            )
+            return
+        except BadRequest as e:
+            # Сбрасываем file_id только если Telegram его не принял; ошибки
+            # разметки, сети и лимитов к картинке отношения не имеют
+            if not re.search(r'(wrong|invalid).*file.?id', e.message, re.IGNORECASE):
+                raise
+            logger.warning(f"Не удалось отправить картинку {image_type} по file_id: {e}")
+            config.invalidate_image_file_id(image_type)
+    
+    image_file = config.get_image_file(image_type)
+    if image_file:
+        try:
+            with open(image_file, 'rb') as photo:
+                sent = await message.reply_photo(
+                    photo=photo,
+                    caption=text,
+                    parse_mode='Markdown',
+                    reply_markup=reply_markup
+                )
+            if sent.photo:
+                config.set_image_file_id(image_type, sent.photo[-1].file_id)
+            return
+        except Exception as e:
+            logger.error(f"Ошибка отправки фото: {e}")
+    
+    await message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+
 async def checkme_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /checkme"""
-    # Проверяем подписку
-    is_subscribed = await require_subscription(update, context)
-    if not is_subscribed:
-        return
-    
     try:
         user = update.effective_user
         user_id = str(user.id)
@@ -1810,21 +4908,21 @@ async def checkme_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         scammer_info = db.check_user(user_id)
         
         if scammer_info:
-            image_file = config.get_image_file("scammer_found")
+            image_type = "scammer_found"
             status_emoji = "🔴"
             status_text = "ВЫ ЕСТЬ В БАЗЕ!"
             scam_chance = 100
-            country = scammer_info.get('country') or 'None'
+            country = country_display(scammer_info.get('country')) or 'None'
             reports = scammer_info.get('reports', 1)
         elif is_admin_user:
-            image_file = config.get_image_file("admin")
+            image_type = "admin"
             status_emoji = "🔵"
             status_text = "АДМИНИСТРАТОР БОТА"
             scam_chance = 0
             country = 'None'
             reports = 0
         else:
-            image_file = config.get_image_file("user_clean")
+            image_type = "user_clean"
             status_emoji = "🟢"
             status_text = "ВАС НЕТ В БАЗЕ!"
             scam_chance = random.randint(1, 10)
@@ -1870,32 +4968,162 @@ async def checkme_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        try:
-            if image_file and os.path.exists(image_file):
-                with open(image_file, 'rb') as photo:
-                    await update.message.reply_photo(
-                        photo=photo,
-                        caption=response,
-                        parse_mode='Markdown',
-                        reply_markup=reply_markup
-                    )
-            else:
-                await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
-        except Exception as e:
-            logger.error(f"Ошибка отправки фото: {e}")
-            await update.message.reply_text(response, parse_mode='Markdown', reply_markup=reply_markup)
+        await reply_card(update.message, image_type, response, reply_markup)
             
     except Exception as e:
         logger.error(f"Ошибка в команде /checkme: {e}", exc_info=True)
         await update.message.reply_text("❌ Произошла ошибка при проверке. Попробуйте позже.")
 
+def format_scammer_line(scammer_info: Dict) -> str:
+    """Краткая строка о скамере для списков (/recent, /search)"""
+    username_display = escape_markdown(str(scammer_info.get('username') or ''))
+    country = country_display(scammer_info.get('country'))
+    return (
+        f"• @{username_display} — `{scammer_info['user_id']}`"
+        f"{f' — {country}' if country else ''}\n"
+        f"   📅 {scammer_info.get('added_date', 'Неизвестно')} | "
+        f"📊 Жалоб: {scammer_info.get('reports', 1)}"
+        f"{' | 🗑️ удален' if scammer_info.get('status') == 'removed' else ''}\n"
+    )
+
+def parse_search_args(args: List[str]) -> Dict:
+    """Разобрать аргументы /search в параметры db.search().
+    
+    Пример: RU from=2026-01-01 to=2026-01-31 status=all reports>=2
+    """
+    params = {'status': 'active'}
+    for arg in args:
+        match = re.fullmatch(r'(\w+)(>=|<=|=)(.+)', arg)
+        if not match:
+            if normalize_country(arg) in COUNTRY_NAMES:
+                params['country'] = arg
+                continue
+            raise ValueError(f"Непонятный параметр: {arg}")
+        
+        name, op, value = match.group(1).lower(), match.group(2), match.group(3)
+        if name in ('country', 'страна') and op == '=':
+            params['country'] = value
+        elif name in ('status', 'статус') and op == '=':
+            if value not in ('active', 'removed', 'all'):
+                raise ValueError("Статус может быть: active, removed, all")
+            params['status'] = None if value == 'all' else value
+        elif name in ('from', 'с', 'to', 'по') and op == '=':
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Дата должна быть в формате ГГГГ-ММ-ДД: {value}")
+            params['date_from' if name in ('from', 'с') else 'date_to'] = value
+        elif name in ('reports', 'жалоб') and value.isdigit():
+            if op in ('>=', '='):
+                params['min_reports'] = int(value)
+            if op in ('<=', '='):
+                params['max_reports'] = int(value)
+        else:
+            raise ValueError(f"Непонятный параметр: {arg}")
+    return params
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск по стране, периоду, статусу и числу жалоб (для админов)"""
+    try:
+        user_id = update.effective_user.id
+        
+        if not has_permission(user_id, UserRole.ADMIN):
+            await update.message.reply_text("❌ У вас нет прав для поиска по базе!")
+            return
+        
+        if not context.args:
+            await update.message.reply_text(
+                "❌ Укажите параметры поиска!\n"
+                "✅ Пример: `/search RU from=2026-01-01 to=2026-01-31 reports>=2`\n\n"
+                "📝 *Параметры:*\n"
+                "• `RU` или `country=RU` - страна\n"
+                "• `status=active|removed|all` - статус (по умолчанию active)\n"
+                "• `from=ГГГГ-ММ-ДД`, `to=ГГГГ-ММ-ДД` - период добавления\n"
+                "• `reports>=N`, `reports<=N` - число жалоб",
+                parse_mode='Markdown'
+            )
+            return
+        
+        try:
+            params = parse_search_args(context.args)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}")
+            return
+        
+        results = db.search(limit=SEARCH_RESULT_LIMIT + 1, **params)
+        
+        if not results:
+            await update.message.reply_text("📭 По вашему запросу ничего не найдено.")
+            return
+        
+        search_text = "🔎 *РЕЗУЛЬТАТЫ ПОИСКА*\n\n"
+        for scammer_info in results[:SEARCH_RESULT_LIMIT]:
+            search_text += format_scammer_line(scammer_info)
+        if len(results) > SEARCH_RESULT_LIMIT:
+            search_text += f"\n_Показаны первые {SEARCH_RESULT_LIMIT} записей, уточните запрос._"
+        
+        await update.message.reply_text(search_text, parse_mode='Markdown')
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /search: {e}", exc_info=True)
+        await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
+
+recent_cursors = TTLCache(RECENT_CURSOR_CACHE_SIZE, RECENT_CURSOR_TTL)
+
+def recent_callback_data(cursor: str) -> str:
+    """callback_data кнопки "Дальше": длинный курсор заменяется токеном (~токен)"""
+    data = f"recent_{cursor}"
+    if len(data.encode('utf-8')) <= CALLBACK_DATA_LIMIT:
+        return data
+    token = secrets.token_urlsafe(8)
+    recent_cursors.set(token, cursor)
+    return f"recent_~{token}"
+
+def build_recent_page(cursor: Optional[str] = None) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Текст и кнопки одной страницы /recent (cursor - из callback_data, в том числе ~токен)"""
+    notice = ''
+    if cursor and cursor.startswith('~'):
+        found, cursor = recent_cursors.get(cursor[1:])
+        if not found:
+            # Токен истек или выдан другим процессом бота
+            notice = "⌛ _Ссылка на страницу устарела, показываю начало списка._\n\n"
+            cursor = None
+    
+    scammers, next_cursor = db.get_recent_page(cursor, RECENT_PAGE_SIZE)
+    
+    if not scammers:
+        return "📭 *Активных скамеров в базе нет.*", None
+    
+    recent_text = notice + "🕒 *ПОСЛЕДНИЕ ДОБАВЛЕННЫЕ СКАМЕРЫ*\n\n"
+    for scammer_info in scammers:
+        recent_text += format_scammer_line(scammer_info)
+    
+    buttons = []
+    if cursor:
+        buttons.append(InlineKeyboardButton("⏮️ В начало", callback_data="recent_start"))
+    if next_cursor:
+        buttons.append(InlineKeyboardButton("➡️ Дальше", callback_data=recent_callback_data(next_cursor)))
+    
+    return recent_text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def recent_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Последние добавленные скамеры с постраничным выводом (для админов)"""
+    try:
+        user_id = update.effective_user.id
+        
+        if not has_permission(user_id, UserRole.ADMIN):
+            await update.message.reply_text("❌ У вас нет прав для просмотра последних добавленных!")
+            return
+        
+        recent_text, reply_markup = build_recent_page()
+        await update.message.reply_text(recent_text, parse_mode='Markdown', reply_markup=reply_markup)
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /recent: {e}", exc_info=True)
+        await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /stats"""
-    # Проверяем подписку
-    is_subscribed = await require_subscription(update, context)
-    if not is_subscribed:
-        return
-    
     stats = db.get_stats()
     
     stats_text = f"""
@@ -1915,6 +5143,98 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(stats_text, parse_mode='Markdown')
 
+async def verify_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пересчитать счетчики статистики и показать расхождения (только владелец)"""
+    try:
+        user_id = update.effective_user.id
+        
+        if not has_permission(user_id, UserRole.OWNER):
+            await update.message.reply_text("❌ Только владелец может проверять счетчики базы!")
+            return
+        
+        drift = db.verify_stats()
+        
+        if drift:
+            drift_text = "\n".join(f"• {name}: {counted} → {actual}" for name, (counted, actual) in drift.items())
+            await update.message.reply_text(
+                f"⚠️ *Найдены расхождения счетчиков (исправлены):*\n\n{drift_text}",
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_text("✅ Счетчики статистики совпадают с базой.")
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /verifystats: {e}", exc_info=True)
+        await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показать внутренние метрики бота (только владелец)"""
+    try:
+        user_id = update.effective_user.id
+        
+        if not has_permission(user_id, UserRole.OWNER):
+            await update.message.reply_text("❌ Только владелец может просматривать метрики!")
+            return
+        
+        metrics_text = "📈 *МЕТРИКИ БОТА*\n\n"
+        
+        if telegram_api is not None:
+            cache = telegram_api.cache
+            total = cache.hits + cache.misses
+            hit_rate = cache.hits / total * 100 if total else 0
+            metrics_text += (
+                f"👤 *Кэш User API:* {len(cache)} записей\n"
+                f"   Попаданий: {cache.hits} | Промахов: {cache.misses} ({hit_rate:.1f}% попаданий)\n"
+                f"   Объединено одновременных запросов: {telegram_api.coalesced}\n"
+                f"   Пакетов GetUsersRequest: {telegram_api.batches_sent} ({telegram_api.batched_ids} ID)\n"
+            )
+        else:
+            metrics_text += "👤 *Кэш User API:* User API не инициализирован\n"
+        
+        total = subscription_cache.hits + subscription_cache.misses
+        hit_rate = subscription_cache.hits / total * 100 if total else 0
+        metrics_text += (
+            f"📢 *Кэш подписки:* {len(subscription_cache)} записей\n"
+            f"   Попаданий: {subscription_cache.hits} | Промахов: {subscription_cache.misses} "
+            f"({hit_rate:.1f}% попаданий)\n"
+        )
+        
+        processor = context.application.update_processor
+        if isinstance(processor, ThrottledUpdateProcessor):
+            metrics_text += (
+                f"🚦 *Очередь обновлений:* {processor.queued} ждут\n"
+                f"   Обработано: админы {processor.processed[PRIORITY_ADMIN]} | "
+                f"команды {processor.processed[PRIORITY_INTERACTIVE]} | "
+                f"кнопки {processor.processed[PRIORITY_BUTTONS]}\n"
+                f"   Отброшено по лимиту: {processor.shed}\n"
+            )
+        
+        cache_stats = db.cache_stats()
+        if cache_stats is not None:
+            total = cache_stats['hits'] + cache_stats['misses']
+            hit_rate = cache_stats['hits'] / total * 100 if total else 0
+            metrics_text += (
+                f"🗃️ *Кэш записей базы:* {cache_stats['size']} записей | "
+                f"попаданий {hit_rate:.1f}%\n"
+            )
+        
+        if isinstance(db, SQLiteScamDatabase) and db.shared:
+            metrics_text += f"🔗 *Общий режим:* получено уведомлений об изменениях: {db.changes_applied}\n"
+        
+        limiter = context.bot.rate_limiter
+        if isinstance(limiter, FloodAwareRateLimiter):
+            metrics_text += (
+                f"📨 *Исходящие:* {limiter.waiting} ждут лимита | "
+                f"{len(background_sends)} фоновых в очереди\n"
+                f"   Повторов после RetryAfter: {limiter.retries}\n"
+            )
+        
+        await update.message.reply_text(metrics_text, parse_mode='Markdown')
+        
+    except Exception as e:
+        logger.error(f"Ошибка в команде /metrics: {e}", exc_info=True)
+        await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
+
 async def set_admin_chat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда для установки админ-чата (только владелец)"""
     try:
@@ -1952,10 +5272,9 @@ async def toggle_subscription_command(update: Update, context: ContextTypes.DEFA
             await update.message.reply_text("❌ Только владелец может управлять проверкой подписки!")
             return
         
-        current_state = config.is_check_subscription_enabled()
-        new_state = not current_state
-        
+        new_state = not config.is_check_subscription_enabled()
         config.set_check_subscription(new_state)
+        subscription_cache.clear()
         
         channel_info = config.get_required_channel()
         
@@ -2019,6 +5338,7 @@ async def set_channel_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             channel_id = int(channel_identifier)
             config.config['required_channel_id'] = channel_id
             config.save_config()
+            subscription_cache.clear()
             
             await update.message.reply_text(
                 f"✅ *ID канала установлен:* `{channel_id}`\n\n"
@@ -2095,6 +5415,7 @@ async def set_channel_id_command(update: Update, context: ContextTypes.DEFAULT_T
         channel_id = int(channel_id_str)
         config.config['required_channel_id'] = channel_id
         config.save_config()
+        subscription_cache.clear()
         
         channel_info = config.get_required_channel()
         
@@ -2111,6 +5432,38 @@ async def set_channel_id_command(update: Update, context: ContextTypes.DEFAULT_T
         logger.error(f"Ошибка в команде /setchannelid: {e}", exc_info=True)
         await update.message.reply_text("❌ Произошла ошибка. Попробуйте позже.")
 
+async def compact_db_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическое сжатие журнала базы в снапшот"""
+    if db.needs_compaction():
+        await db.compact()
+
+async def reload_files_job(context: ContextTypes.DEFAULT_TYPE):
+    """Подхватить изменения config.json и базы, сделанные в обход бота"""
+    apply_config_changes(config.reload_if_changed())
+    await db.reload_if_changed()
+
+def apply_config_changes(changed: set):
+    """Сбросить то, что зависит от изменившихся настроек"""
+    if changed & {'required_channel_id', 'required_channel_username', 'check_subscription'}:
+        subscription_cache.clear()
+
+async def sync_shared_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Подхватить изменения, сделанные другими воркерами (режим shared_state)"""
+    config_names = db.poll_changes()
+    if config_names is None or config_names:
+        apply_config_changes(config.apply_shared_config(db.load_shared_config(config_names)))
+
+async def post_stop(application: Application):
+    """Дождаться фоновых уведомлений, пока бот еще может отправлять сообщения"""
+    if background_sends:
+        print(f"📨 Отправка отложенных уведомлений: {len(background_sends)}")
+        await asyncio.wait(background_sends, timeout=15)
+
+async def post_shutdown(application: Application):
+    """Сохранение отложенных изменений при остановке бота"""
+    flush_pending_writes()
+    print("💾 Отложенные изменения сохранены")
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
     logger.error(f"Ошибка: {context.error}", exc_info=True)
@@ -2139,6 +5492,56 @@ async def init_telegram_api():
         print(f"⚠️ Telegram User API не подключен, но бот продолжит работу")
         return False
 
+def get_webhook_settings(workers: int = 1) -> Optional[Dict]:
+    """Настройки webhook из конфига и переменных окружения (None - режим polling).
+    
+    Переменные окружения BOT_MODE, WEBHOOK_URL, WEBHOOK_URL_PATH, WEBHOOK_LISTEN,
+    WEBHOOK_PORT, WEBHOOK_SECRET_TOKEN и WEBHOOK_MAX_CONNECTIONS важнее конфига.
+    workers - число воркеров общего режима: при нескольких воркерах токен
+    обязателен (ValueError, если не задан).
+    """
+    settings = dict(DEFAULT_CONFIG['webhook'])
+    settings.update(config.config.get('webhook') or {})
+    
+    env_overrides = {
+        'url': 'WEBHOOK_URL',
+        'url_path': 'WEBHOOK_URL_PATH',
+        'listen': 'WEBHOOK_LISTEN',
+        'port': 'WEBHOOK_PORT',
+        'secret_token': 'WEBHOOK_SECRET_TOKEN',
+        'max_connections': 'WEBHOOK_MAX_CONNECTIONS',
+    }
+    for key, env_name in env_overrides.items():
+        value = os.getenv(env_name)
+        if value:
+            settings[key] = value
+    
+    mode = os.getenv('BOT_MODE')
+    if mode:
+        settings['enabled'] = mode.lower() == 'webhook'
+    elif os.getenv('WEBHOOK_URL'):
+        settings['enabled'] = True
+    
+    if not settings['enabled']:
+        return None
+    if not settings['url']:
+        logger.error("Webhook включен, но не указан внешний адрес (webhook.url / WEBHOOK_URL), использую polling")
+        return None
+    
+    settings['port'] = int(settings['port'])
+    settings['max_connections'] = int(settings['max_connections'])
+    settings['url_path'] = str(settings['url_path']).strip('/')
+    if not settings['secret_token']:
+        if workers > 1:
+            # Каждый воркер сгенерировал бы свой токен, и setWebhook последнего
+            # из них заставил бы остальных отклонять все обновления
+            raise ValueError("Для нескольких воркеров (shared_state.workers > 1) нужно задать "
+                             "webhook.secret_token или WEBHOOK_SECRET_TOKEN")
+        # Без заданного токена каждый запуск получает свой
+        settings['secret_token'] = secrets.token_urlsafe(32)
+        logger.warning("webhook.secret_token не задан, сгенерирован временный токен")
+    return settings
+
 async def main():
     """Основная функция запуска бота"""
     try:
@@ -2152,6 +5555,7 @@ async def main():
         print(f"🔍 Проверка файлов конфигурации...")
         print(f"   ✅ Файл конфигурации: {'СУЩЕСТВУЕТ' if os.path.exists(CONFIG_FILE) else '❌ ОТСУТСТВУЕТ'}")
         print(f"   ✅ База данных: {'СУЩЕСТВУЕТ' if os.path.exists(DB_FILE) else '❌ ОТСУТСТВУЕТ'}")
+        print(f"   ✅ Хранилище базы: {config.config.get('storage_backend', 'json')}")
         print(f"   ✅ Папка для картинок: {'СУЩЕСТВУЕТ' if os.path.exists(IMAGES_FOLDER) else '❌ ОТСУТСТВУЕТ'}")
         
         if not os.path.exists(CONFIG_FILE):
@@ -2172,20 +5576,45 @@ async def main():
         await init_telegram_api()
         
         print("\n🤖 Создание приложения бота...")
-        application = Application.builder().token(TOKEN).build()
+        shared_state = get_shared_state_settings(config)
+        webhook = get_webhook_settings(shared_state['workers'] if shared_state else 1)
+        application = (
+            Application.builder()
+            .token(TOKEN)
+            .concurrent_updates(ThrottledUpdateProcessor())
+            .rate_limiter(FloodAwareRateLimiter(shared_state['workers'] if shared_state else 1))
+            .post_stop(post_stop)
+            .post_shutdown(post_shutdown)
+            .build()
+        )
         print("✅ Приложение создано")
         
         print("\n📋 Регистрация обработчиков команд...")
         
+        # Проверка подписки до основных команд и отслеживание вступлений в канал
+        application.add_handler(MessageHandler(filters.COMMAND, subscription_gate), group=-1)
+        application.add_handler(ChatMemberHandler(track_channel_membership, ChatMemberHandler.CHAT_MEMBER))
+        
         # Основные команды (с проверкой подписки)
         application.add_handler(CommandHandler("start", start_command))
         application.add_handler(CommandHandler("help", help_command))
         application.add_handler(CommandHandler("check", check_command))
+        application.add_handler(CommandHandler("checkmany", checkmany_command))
+        application.add_handler(InlineQueryHandler(inline_query_handler))
         application.add_handler(CommandHandler("checkme", checkme_command))
         application.add_handler(CommandHandler("stats", stats_command))
+        application.add_handler(CommandHandler("verifystats", verify_stats_command))
+        application.add_handler(CommandHandler("metrics", metrics_command))
         
         # Команды для админов (в админ-чате)
         application.add_handler(CommandHandler("add", add_command))
+        application.add_handler(CommandHandler("recent", recent_command))
+        application.add_handler(CommandHandler("search", search_command))
+        
+        # Импорт базы из файла (только владелец)
+        application.add_handler(CommandHandler("import", import_command))
+        application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r'^/import'), import_command))
+        application.add_handler(CommandHandler("export", export_command))
         
         # Команды для управления админами
         application.add_handler(CommandHandler("addadmin", add_admin_command))
@@ -2212,6 +5641,13 @@ async def main():
         application.add_error_handler(error_handler)
         print("✅ Все обработчики зарегистрированы")
         
+        # Фоновое сжатие журнала базы
+        application.job_queue.run_repeating(compact_db_job, interval=JOURNAL_COMPACT_INTERVAL)
+        # Горячая перезагрузка файлов, измененных вручную
+        application.job_queue.run_repeating(reload_files_job, interval=RELOAD_CHECK_INTERVAL)
+        if shared_state:
+            application.job_queue.run_repeating(sync_shared_state_job, interval=SHARED_POLL_INTERVAL)
+        
         try:
             bot_info = await application.bot.get_me()
             print(f"\n🤖 Информация о боте:")
@@ -2238,12 +5674,33 @@ async def main():
         print(f"👤 Username админ-чата: {config.get_admin_chat_username()}")
         print(f"🛡️ Спец-админы: {config.config['special_admins']}")
         print(f"👮 Админы: {config.config['admins']}")
+        if shared_state:
+            print(f"🔗 Общий режим: {shared_state['workers']} воркеров на базе {SQLITE_DB_FILE}")
         print(f"{'='*50}")
         print("📡 Ожидание команд...")
         print("Для остановки нажмите Ctrl+C")
         
-        # Запускаем polling
-        await application.run_polling(allowed_updates=Update.ALL_TYPES, close_loop=False)
+        if webhook:
+            webhook_url = f"{webhook['url'].rstrip('/')}/{webhook['url_path']}"
+            print(f"🌐 Режим webhook: {webhook_url}")
+            print(f"   Слушаю {webhook['listen']}:{webhook['port']}, max_connections={webhook['max_connections']}")
+            
+            await application.run_webhook(
+                listen=webhook['listen'],
+                port=webhook['port'],
+                url_path=webhook['url_path'],
+                webhook_url=webhook_url,
+                secret_token=webhook['secret_token'],
+                max_connections=webhook['max_connections'],
+                allowed_updates=Update.ALL_TYPES,
+                close_loop=False
+            )
+        else:
+            if shared_state and shared_state['workers'] > 1:
+                # getUpdates из нескольких процессов возвращает Conflict
+                logger.warning("Общий режим с несколькими воркерами требует webhook, polling допустим только в одном процессе")
+            # Запускаем polling
+            await application.run_polling(allowed_updates=Update.ALL_TYPES, close_loop=False)
         
     except Exception as e:
         print(f"\n❌ КРИТИЧЕСКАЯ ОШИБКА ПРИ ЗАПУСКЕ БОТА: {e}")
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+# bot.py - скрипт, а не пакет: импортируем его из папки бота
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def json_db(tmp_path):
+    database = bot.ScamDatabase(str(tmp_path / 'scammers_db.json'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    database = bot.SQLiteScamDatabase(str(tmp_path / 'scammers.sqlite3'), json_file=None)
+    yield database
+    database.close()
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def any_db(request):
+    """Одни и те же проверки для обоих хранилищ"""
+    return request.getfixturevalue(f'{request.param}_db')
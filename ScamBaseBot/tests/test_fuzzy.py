@@ -0,0 +1,48 @@
+import bot
+
+
+def make_index(*names):
+    index = bot.FuzzyIndex()
+    for name in names:
+        index.add(name, name)
+    return index
+
+
+def test_typo_and_homoglyphs_are_found():
+    index = make_index('scammer_ivan', 'honest_user')
+
+    assert index.search('scamer_ivan') == [('scammer_ivan', 1)]
+    assert index.search('SCAMMER_lVAN')[0] == ('scammer_ivan', 0)
+
+
+def test_long_query_finds_shorter_contained_name():
+    index = make_index('5553', 'stepa_shop')
+
+    assert [key for key, _ in index.search('stepa5553official')] == ['5553']
+
+
+def test_short_query_finds_longer_name_containing_it():
+    index = make_index('durov_real_2024')
+
+    assert [key for key, _ in index.search('durov')] == ['durov_real_2024']
+
+
+def test_distance_limit_follows_shorter_name():
+    # Длинный запрос не дает короткому имени лишних правок
+    index = make_index('abcde')
+
+    assert index.search('abxyeqqqqqqqqqqq') == []
+
+
+def test_unrelated_names_are_not_returned():
+    index = make_index('alpha_trader', 'crypto_king', 'support_bot')
+
+    assert index.search('zeta_shop') == []
+
+
+def test_removed_name_is_forgotten():
+    index = make_index('scammer_ivan')
+    index.remove('scammer_ivan', 'scammer_ivan')
+
+    assert index.search('scammer_ivan') == []
+    assert index._grams == {} and index._sizes == {}
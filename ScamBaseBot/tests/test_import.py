@@ -0,0 +1,65 @@
+import io
+import json
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def tiny_chunks(monkeypatch):
+    # Куски меньше одной записи: разбор должен склеивать их на границах
+    monkeypatch.setattr(bot, 'IMPORT_READ_CHUNK', 7)
+
+
+def test_json_object_and_array_are_streamed(tiny_chunks):
+    data = {'1001': {'username': 'first', 'reports': 12345}, '1002': {'username': 'второй'}}
+
+    assert list(bot.iter_json_entries(io.StringIO(json.dumps(data, ensure_ascii=False, indent=2)))) == \
+        list(data.items())
+    assert list(bot.iter_json_entries(io.StringIO(json.dumps(list(data.values()))))) == \
+        [(None, value) for value in data.values()]
+
+
+def test_truncated_json_is_reported(tiny_chunks):
+    with pytest.raises(ValueError):
+        list(bot.iter_json_entries(io.StringIO('{"1001": {"username": "first"}, "1002": {')))
+
+
+@pytest.mark.parametrize('file_name, content', [
+    ('list.csv', 'user_id,username,reason\n1001,first,скам\n'),
+    ('list.ndjson', '{"user_id": "1001", "username": "first", "reason": "скам"}\n'),
+    ('list.json', '[{"user_id": "1001", "username": "first", "reason": "скам"}]'),
+    ('list.txt', 'user_id,username,reason\n1001,first,скам\n'),
+    ('list.txt', '{"user_id": "1001", "username": "first", "reason": "скам"}\n'),
+])
+def test_format_is_detected(file_name, content):
+    entries = list(bot.iter_import_entries(io.StringIO(content), file_name))
+
+    assert [bot.normalize_import_entry(key, raw)['username'] for key, raw in entries] == ['first']
+
+
+def test_normalize_import_entry():
+    entry = bot.normalize_import_entry('777', {'reason': 'скам', 'proof': 'https://t.me/c/1/2',
+                                               'country': '🇷🇺 Россия', 'added_date': 'вчера'})
+
+    assert entry == {'user_id': '777', 'username': 'id777', 'reasons': ['скам'],
+                     'proofs': ['https://t.me/c/1/2'], 'reports': 1, 'country': 'RU', 'added_date': ''}
+    assert bot.normalize_import_entry(None, {'username': 'x', 'status': 'removed'}) is None
+    assert bot.normalize_import_entry(None, {}) is None
+
+
+def test_import_merges_into_existing_records(any_db):
+    any_db.add_scammer('777', 'RealName', 'скам', 1)
+    rows = [{'user_id': '777', 'reasons': ['кидок'], 'reports': 3},
+            {'username': '@new_one', 'reason': 'скам'}]
+
+    result = any_db.import_records([bot.normalize_import_entry(None, row) for row in rows], 1)
+
+    assert result == {'added': 1, 'updated': 1}
+    merged = any_db.check_user('777')
+    # Строка только с ID не заменяет имя заглушкой id777
+    assert merged['username'] == 'RealName'
+    assert merged['reasons'] == ['скам', 'кидок']
+    assert merged['reports'] == 4
+    assert any_db.find_scammer_by_username('new_one')['reasons'] == ['скам']
@@ -0,0 +1,37 @@
+import re
+
+import bot
+
+
+def walk_pages():
+    """Пройти /recent по кнопкам "Дальше" и вернуть ID всех показанных записей"""
+    seen = []
+    cursor = None
+    while True:
+        text, markup = bot.build_recent_page(cursor)
+        seen.extend(re.findall(r'`([^`]+)`', text))
+        next_data = [button.callback_data for row in (markup.inline_keyboard if markup else [])
+                     for button in row if button.callback_data != 'recent_start']
+        if not next_data:
+            return seen
+        assert len(next_data[0].encode('utf-8')) <= bot.CALLBACK_DATA_LIMIT
+        cursor = next_data[0][len('recent_'):]
+
+
+def test_long_cursors_keep_pagination_going(json_db, monkeypatch):
+    monkeypatch.setattr(bot, 'db', json_db)
+    keys = [f"very_long_username_for_pagination_{i:02d}_x" for i in range(25)]
+    for key in keys:
+        json_db.add_scammer(key, key, 'скам', 1)
+
+    assert sorted(walk_pages()) == sorted(keys)
+
+
+def test_expired_cursor_token_restarts_from_first_page(json_db, monkeypatch):
+    monkeypatch.setattr(bot, 'db', json_db)
+    json_db.add_scammer('1001', 'first', 'скам', 1)
+
+    text, _ = bot.build_recent_page('~missing')
+
+    assert text.startswith('⌛')
+    assert 'first' in text
@@ -0,0 +1,210 @@
+import asyncio
+import gzip
+import json
+import sqlite3
+
+import bot
+
+
+def reopen(database):
+    database.close()
+    return bot.ScamDatabase(database.db_file)
+
+
+def test_journal_replayed_after_restart(json_db):
+    json_db.add_scammer('1001', 'first', 'скам', 1)
+    json_db.add_scammer('1002', 'second', 'скам', 1)
+    json_db.remove_scammer('1002')
+    json_db.set_country('1001', 'RU')
+
+    reopened = reopen(json_db)
+    try:
+        assert reopened.check_user('1001')['country'] == 'RU'
+        assert reopened.check_user('1002') is None
+        assert reopened.get_stats()['removed_scammers'] == 1
+    finally:
+        reopened.close()
+
+
+def test_compaction_moves_journal_into_snapshot(json_db):
+    json_db.add_scammer('1001', 'first', 'скам', 1)
+    assert json_db.journal_records == 1
+
+    assert asyncio.run(json_db.compact(wait=True))
+    assert json_db.journal_records == 0
+    with open(json_db.journal_file, 'rb') as f:
+        assert f.read() == b''
+
+    reopened = reopen(json_db)
+    try:
+        assert reopened.find_scammer_by_username('@FIRST')['user_id'] == '1001'
+    finally:
+        reopened.close()
+
+
+def test_torn_journal_line_is_skipped(json_db):
+    json_db.add_scammer('1001', 'first', 'скам', 1)
+    json_db.flush()
+    with open(json_db.journal_file, 'a', encoding='utf-8') as f:
+        f.write('{"op": "set", "id": "1002", "da')
+
+    reopened = reopen(json_db)
+    try:
+        assert reopened.check_user('1001') is not None
+        assert reopened.check_user('1002') is None
+    finally:
+        reopened.close()
+
+
+def test_write_behind_batches_journal_writes(tmp_path):
+    async def scenario():
+        database = bot.ScamDatabase(str(tmp_path / 'db.json'),
+                                    write_behind={'enabled': True, 'delay_ms': 60000, 'max_pending': 3})
+        try:
+            database.add_scammer('1001', 'first', 'скам', 1)
+            database.add_scammer('1002', 'second', 'скам', 1)
+            assert database.journal_records == 0
+
+            database.add_scammer('1003', 'third', 'скам', 1)
+            assert database.journal_records == 3
+        finally:
+            database.close()
+
+    asyncio.run(scenario())
+
+
+def test_old_format_snapshot_is_indexed_without_rewrite(tmp_path):
+    db_file = tmp_path / 'db.json'
+    records = {
+        'Mixed': {'user_id': 'Mixed', 'username': 'Mixed', 'status': 'active', 'reports': 2,
+                  'reasons': ['a "quoted" {brace}'], 'added_date': '2026-01-01 10:00:00'},
+        'skipped': 5,
+        '1001': {'user_id': '1001', 'username': 'Юзер', 'status': 'removed', 'reports': 1},
+    }
+    db_file.write_bytes(json.dumps(records, ensure_ascii=False, indent=2).replace('\n', '\r\n').encode())
+    original = db_file.read_bytes()
+
+    database = bot.ScamDatabase(str(db_file))
+    try:
+        assert db_file.read_bytes() == original
+        assert sorted(database.db) == ['1001', 'Mixed']
+        assert database.check_user('Mixed')['reasons'] == ['a "quoted" {brace}']
+        assert database.get_stats() == {'total_scammers': 1, 'total_reports': 2,
+                                        'removed_scammers': 1, 'total_in_db': 2}
+    finally:
+        database.close()
+
+
+def test_add_merges_repeat_reports(any_db):
+    assert any_db.add_scammer('1001', 'first', 'скам', 1) == (True, "Успешно добавлен", True)
+    assert any_db.add_scammer('1001', 'renamed', 'кидок', 1, proof_link='https://t.me/c/1/2')[2] is False
+
+    record = any_db.check_user('1001')
+    assert record['username'] == 'renamed'
+    assert record['reasons'] == ['скам', 'кидок']
+    assert record['reports'] == 2
+    assert any_db.find_scammer_by_username('first') is None
+    assert any_db.find_scammer_by_username('@Renamed')['user_id'] == '1001'
+
+
+def test_stats_follow_changes(any_db):
+    any_db.add_scammer('1001', 'first', 'скам', 1)
+    any_db.add_scammer('1002', 'second', 'скам', 1)
+    any_db.increment_reports('1002')
+    any_db.remove_scammer('1001')
+
+    assert any_db.get_stats() == {'total_scammers': 1, 'total_reports': 2,
+                                  'removed_scammers': 1, 'total_in_db': 2}
+    assert any_db.verify_stats() == {}
+
+
+def test_search_by_country_and_recent_pages(any_db):
+    for i in range(5):
+        any_db.add_scammer(str(1001 + i), f'user{i}', 'скам', 1, country='UA' if i % 2 else 'RU')
+    any_db.set_country('1001', 'KZ')
+
+    assert {r['user_id'] for r in any_db.search(country='RU')} == {'1003', '1005'}
+    assert [r['user_id'] for r in any_db.search_by_country('kz')] == ['1001']
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor = any_db.get_recent_page(cursor, limit=2)
+        seen.extend(r['user_id'] for r in page)
+        if cursor is None:
+            break
+    assert sorted(seen) == ['1001', '1002', '1003', '1004', '1005']
+    assert len(set(seen)) == 5
+
+
+def test_mixed_case_key_found_by_username(any_db):
+    any_db.add_scammer('Int1xKrashed', 'Int1xKrashed', 'скам', 1)
+    any_db.add_scammer('1001', 'other', 'скам', 1)
+
+    assert any_db.find_scammer_by_username('@int1xkrashed')['user_id'] == 'Int1xKrashed'
+    assert [r['user_id'] for r in any_db.find_by_prefix('INT1X')] == ['Int1xKrashed']
+
+
+def test_sqlite_fills_key_norm_for_old_bases(tmp_path):
+    sqlite_file = str(tmp_path / 'old.sqlite3')
+    conn = sqlite3.connect(sqlite_file)
+    conn.executescript(bot.SQLiteScamDatabase.SCHEMA.replace(',\n            key_norm TEXT', ''))
+    record = {'user_id': 'Mixed', 'username': 'renamed', 'status': 'active', 'reports': 1}
+    conn.execute("INSERT INTO scammers (key, user_id, username, username_norm, status, data) "
+                 "VALUES ('Mixed', 'Mixed', 'renamed', 'renamed', 'active', ?)", (json.dumps(record),))
+    conn.commit()
+    conn.close()
+
+    database = bot.SQLiteScamDatabase(sqlite_file, json_file=None)
+    try:
+        assert database.find_scammer_by_username('mixed')['username'] == 'renamed'
+    finally:
+        database.close()
+
+
+def test_legacy_country_names_are_searched_and_exported_as_codes(tmp_path):
+    json_file = tmp_path / 'legacy.json'
+    json_file.write_text(json.dumps({
+        'a': {'user_id': 'a', 'username': 'a', 'status': 'active', 'reports': 1,
+              'country': '🇷🇺 Россия', 'added_date': '2026-01-01 10:00:00'},
+        'b': {'user_id': 'b', 'username': 'b', 'status': 'active', 'reports': 1,
+              'country': 'Страна UA', 'added_date': '2026-01-02 10:00:00'},
+    }, ensure_ascii=False), encoding='utf-8')
+
+    backends = [bot.ScamDatabase(str(json_file)),
+                bot.SQLiteScamDatabase(str(tmp_path / 'legacy.sqlite3'), json_file=str(json_file))]
+    for database in backends:
+        try:
+            assert [r['user_id'] for r in database.search(country='ru')] == ['a']
+
+            out = tmp_path / f'{type(database).__name__}.ndjson.gz'
+            assert asyncio.run(database.export(str(out), 'ndjson')) == 2
+            with gzip.open(out, 'rt', encoding='utf-8') as f:
+                exported = {row['user_id']: row['country'] for row in map(json.loads, f)}
+            assert exported == {'a': 'RU', 'b': 'UA'}
+        finally:
+            database.close()
+
+
+def test_cache_stats(json_db, tmp_path):
+    json_db.add_scammer('1001', 'first', 'скам', 1)
+    asyncio.run(json_db.compact(wait=True))
+    reopened = reopen(json_db)
+    try:
+        reopened.check_user('1001')
+        reopened.check_user('1001')
+        assert reopened.cache_stats() == {'size': 1, 'hits': 1, 'misses': 1}
+    finally:
+        reopened.close()
+
+    plain = bot.SQLiteScamDatabase(str(tmp_path / 'plain.sqlite3'), json_file=None)
+    shared = bot.SQLiteScamDatabase(str(tmp_path / 'shared.sqlite3'), json_file=None, shared=True)
+    try:
+        assert plain.cache_stats() is None
+        shared.add_scammer('1001', 'first', 'скам', 1)
+        shared.check_user('1001')
+        shared.check_user('1001')
+        assert shared.cache_stats()['hits'] == 1
+    finally:
+        plain.close()
+        shared.close()
@@ -0,0 +1,45 @@
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    processor = bot.ThrottledUpdateProcessor()
+
+    assert all(processor._take_token(1) for _ in range(bot.THROTTLE_BURST))
+    assert not processor._take_token(1)
+
+    clock[0] += 1 / bot.THROTTLE_RATE
+    assert processor._take_token(1)
+    assert not processor._take_token(1)
+
+
+def test_buckets_are_per_user(clock):
+    processor = bot.ThrottledUpdateProcessor()
+    for _ in range(bot.THROTTLE_BURST):
+        processor._take_token(1)
+
+    assert not processor._take_token(1)
+    assert processor._take_token(2)
+
+
+def test_inline_queries_use_their_own_bucket(clock):
+    processor = bot.ThrottledUpdateProcessor()
+    for _ in range(bot.THROTTLE_BURST):
+        processor._take_token(1)
+    assert not processor._take_token(1)
+
+    # Набор имени в inline не упирается в корзину команд...
+    assert all(processor._take_token(1, inline=True) for _ in range(bot.THROTTLE_INLINE_BURST))
+    # ...но и без ограничения не остается
+    assert not processor._take_token(1, inline=True)
+
+    clock[0] += 1 / bot.THROTTLE_INLINE_RATE
+    assert processor._take_token(1, inline=True)